@@ -19,11 +19,14 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Pinggo.settings')
 
 django_asgi_app = get_asgi_application()
 
+from chats.middleware import EmailVerifiedWebsocketMiddleware
 from chats.routing import websocket_urlpatterns
 
 application = ProtocolTypeRouter({
     'http': django_asgi_app,
     'websocket': AllowedHostsOriginValidator(
-        AuthMiddlewareStack(URLRouter(websocket_urlpatterns))
+        AuthMiddlewareStack(
+            EmailVerifiedWebsocketMiddleware(URLRouter(websocket_urlpatterns))
+        )
     ),
 })
@@ -0,0 +1,158 @@
+from contextvars import ContextVar
+from functools import wraps
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+
+
+PRIMARY = "default"
+REPLICA = "replica"
+
+# Writes that shouldn't pin a user to the primary: read markers and
+# sessions are written on plain page views.
+STICKY_EXEMPT = {"sessions.session", "chats.chatmembership"}
+
+
+class ReplicaState:
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.allowed = False
+        self.wrote = False
+
+
+_state = ContextVar("replica_state", default=None)
+_marked = {}
+_pruned_at = 0.0
+
+
+def sticky_key(user_id):
+    return f"db-sticky:{user_id}"
+
+
+def is_sticky(user_id):
+    return user_id is not None and cache.get(sticky_key(user_id)) is not None
+
+
+def remark_interval():
+    return settings.REPLICA_STICKY_SECONDS / 2
+
+
+def sticky_timeout():
+    # A write within remark_interval() of the last mark doesn't refresh it,
+    # so the marker lasts that much longer: every write gets the full
+    # REPLICA_STICKY_SECONDS after it.
+    return math.ceil(settings.REPLICA_STICKY_SECONDS + remark_interval())
+
+
+def claim_mark(user_id):
+    """
+    Whether ``user_id``'s sticky marker needs writing. Re-marking is skipped
+    for remark_interval(), so frequent posters cost one cache write, not one
+    per message. Entries past that interval are pruned (at most once per
+    interval), so the map only ever holds recent writers.
+    """
+    global _pruned_at
+
+    now = time.monotonic()
+    window = remark_interval()
+    marked_at = _marked.get(user_id)
+
+    if marked_at is not None and now - marked_at < window:
+        return False
+
+    if now - _pruned_at >= window:
+        _pruned_at = now
+        for key, marked_at in list(_marked.items()):
+            if now - marked_at >= window:
+                _marked.pop(key, None)
+
+    _marked[user_id] = now
+    return True
+
+
+def mark_sticky(user_id):
+    """
+    Keep ``user_id``'s reads on the primary for at least
+    REPLICA_STICKY_SECONDS so they see their own writes.
+    """
+    if claim_mark(user_id):
+        cache.set(sticky_key(user_id), 1, sticky_timeout())
+
+
+async def amark_sticky(user_id):
+    if claim_mark(user_id):
+        await cache.aset(sticky_key(user_id), 1, sticky_timeout())
+
+
+def use_replica(view):
+    """
+    Let a read-heavy view read from the replica, unless the user wrote
+    recently. Any write during the request sends its later reads back to
+    the primary.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        state = _state.get()
+
+        if state is not None and REPLICA in settings.DATABASES and not is_sticky(state.user_id):
+            state.allowed = True
+
+        return view(request, *args, **kwargs)
+
+    return wrapper
+
+
+class ReplicaRouter:
+    """
+    Reads go to the primary unless the current request was opted in with
+    ``use_replica``; writes always go to the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+
+        if state is None or not state.allowed or connections[PRIMARY].in_atomic_block:
+            return PRIMARY
+
+        return REPLICA
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+
+        if state is not None and model._meta.label_lower not in STICKY_EXEMPT:
+            state.allowed = False
+            state.wrote = True
+
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == PRIMARY
+
+
+class ReplicaStickinessMiddleware:
+    """
+    Tracks the request for ReplicaRouter and pins users who wrote something
+    to the primary for a while afterwards.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        user_id = request.user.id if request.user.is_authenticated else None
+        state = ReplicaState(user_id)
+        token = _state.set(state)
+
+        try:
+            return self.get_response(request)
+        finally:
+            _state.reset(token)
+
+            if state.wrote and user_id is not None:
+                mark_sticky(user_id)
@@ -0,0 +1,140 @@
+from collections import Counter
+import atexit
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+from django.conf import settings
+from django_redis import get_redis_connection
+
+
+logger = logging.getLogger(__name__)
+
+# Cluster-wide totals: every process adds its counts here, so they survive
+# restarts and cover all Daphne workers. Read with "manage.py chat_metrics".
+COUNTERS_KEY = "metrics:counters"
+
+# Point-in-time reports (e.g. outbox depths), one key per process and
+# reporter, expiring when the process stops refreshing them.
+REPORT_PREFIX = "metrics:report:"
+PROCESS = f"{socket.gethostname()}:{os.getpid()}"
+
+
+class Metrics:
+    """
+    Counters for the chat hot paths. Increments are in-process and cheap; a
+    daemon thread adds them to the shared Redis hash every
+    METRICS_FLUSH_INTERVAL seconds, and once more at exit. Reporters
+    registered with ``reporter`` are called on each flush and their result
+    stored for this process.
+    """
+
+    def __init__(self):
+        self.counters = Counter()
+        self.lock = threading.Lock()
+        self.flusher = None
+        self.reporters = {}
+
+    def incr(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+        if self.flusher is None:
+            self.start()
+
+    def reporter(self, name):
+        """
+        Register a function returning a JSON-serializable report. It runs
+        on the flusher thread.
+        """
+        def register(report):
+            self.reporters[name] = report
+            return report
+        return register
+
+    def start(self):
+        if self.flusher is not None:
+            return
+
+        with self.lock:
+            if self.flusher is not None:
+                return
+
+            self.flusher = threading.Thread(target=self.run, name="metrics-flusher", daemon=True)
+            self.flusher.start()
+
+        atexit.register(self.flush)
+
+    def run(self):
+        while True:
+            time.sleep(settings.METRICS_FLUSH_INTERVAL)
+
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Can't publish metrics")
+
+    def flush(self):
+        with self.lock:
+            counters, self.counters = self.counters, Counter()
+
+        reports = {name: report() for name, report in self.reporters.items()}
+
+        try:
+            pipe = get_redis_connection("default").pipeline(transaction=False)
+            for name, value in counters.items():
+                pipe.hincrby(COUNTERS_KEY, name, value)
+            for name, report in reports.items():
+                pipe.set(
+                    f"{REPORT_PREFIX}{name}:{PROCESS}",
+                    json.dumps(report),
+                    ex=max(int(settings.METRICS_FLUSH_INTERVAL * 3), 1),
+                )
+            pipe.execute()
+        except Exception:
+            # Keep the counts for the next flush.
+            with self.lock:
+                self.counters.update(counters)
+            raise
+
+    def snapshot(self):
+        """
+        This process' counts not yet published.
+        """
+        with self.lock:
+            return dict(self.counters)
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+
+    @staticmethod
+    def totals():
+        counters = get_redis_connection("default").hgetall(COUNTERS_KEY)
+        return {name.decode(): int(value) for name, value in counters.items()}
+
+    @staticmethod
+    def reports(name):
+        """
+        The latest ``name`` report of every live process, by process.
+        """
+        redis = get_redis_connection("default")
+        prefix = f"{REPORT_PREFIX}{name}:"
+        reports = {}
+
+        for key in redis.scan_iter(match=f"{prefix}*"):
+            value = redis.get(key)
+            if value is not None:
+                reports[key.decode()[len(prefix):]] = json.loads(value)
+
+        return reports
+
+    @staticmethod
+    def reset_totals():
+        get_redis_connection("default").delete(COUNTERS_KEY)
+
+
+metrics = Metrics()
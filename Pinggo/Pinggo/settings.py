@@ -43,6 +43,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'django_cleanup.apps.CleanupConfig',
     'django_htmx',
     'allauth',
@@ -67,6 +68,7 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'allauth.account.middleware.AccountMiddleware',
     'django_htmx.middleware.HtmxMiddleware',
+    'Pinggo.db_router.ReplicaStickinessMiddleware',
 ]
 
 AUTHENTICATION_BACKENDS = [
@@ -110,10 +112,89 @@ CHANNEL_LAYERS = {
     }
 }
 
+REDIS_URL = getenv('UPSTASH_REDIS_URL', 'redis://127.0.0.1:6379/1')
+
+# Pool size for the redis.asyncio client used from consumers (presence etc.)
+REDIS_MAX_CONNECTIONS = int(getenv('REDIS_MAX_CONNECTIONS', 50))
+
+# Presence is tracked per connection and kept alive by consumer heartbeats;
+# connections not seen for PRESENCE_TTL seconds are reaped.
+PRESENCE_HEARTBEAT_INTERVAL = int(getenv('PRESENCE_HEARTBEAT_INTERVAL', 30))
+PRESENCE_TTL = int(getenv('PRESENCE_TTL', 90))
+PRESENCE_REAP_BATCH = int(getenv('PRESENCE_REAP_BATCH', 500))
+
+# At most one online-count broadcast per room per interval (seconds).
+PRESENCE_BROADCAST_INTERVAL = float(getenv('PRESENCE_BROADCAST_INTERVAL', 1.0))
+
+# Write-behind persistence for WebSocket messages: messages get their id up
+# front, are broadcast immediately and are inserted in batches. Pending rows
+# are flushed on shutdown, but a hard crash can lose up to one batch.
+CHAT_WRITE_BEHIND = getenv('CHAT_WRITE_BEHIND', 'False') == 'True'
+CHAT_WRITE_BEHIND_BATCH_SIZE = int(getenv('CHAT_WRITE_BEHIND_BATCH_SIZE', 100))
+CHAT_WRITE_BEHIND_INTERVAL = float(getenv('CHAT_WRITE_BEHIND_INTERVAL', 0.2))
+CHAT_WRITE_BEHIND_RETRIES = int(getenv('CHAT_WRITE_BEHIND_RETRIES', 5))
+
+# Recent messages kept per room in Redis for reconnect replay, and the most
+# a reconnecting client is replayed before it is told to reload instead.
+CHAT_REPLAY_BUFFER_SIZE = int(getenv('CHAT_REPLAY_BUFFER_SIZE', 500))
+CHAT_REPLAY_LIMIT = int(getenv('CHAT_REPLAY_LIMIT', 200))
+
+# Token-bucket flood protection for chat sends: RATE tokens per second with
+# bursts of up to BURST, per user and per room. In shared mode the buckets
+# live in Redis and each node leases LEASE tokens at a time.
+CHAT_RATE_LIMIT_ENABLED = getenv('CHAT_RATE_LIMIT_ENABLED', 'True') == 'True'
+CHAT_RATE_LIMIT_SHARED = getenv('CHAT_RATE_LIMIT_SHARED', 'False') == 'True'
+CHAT_RATE_LIMIT_LEASE = int(getenv('CHAT_RATE_LIMIT_LEASE', 5))
+CHAT_RATE_LIMIT_USER_RATE = float(getenv('CHAT_RATE_LIMIT_USER_RATE', 1.0))
+CHAT_RATE_LIMIT_USER_BURST = int(getenv('CHAT_RATE_LIMIT_USER_BURST', 5))
+CHAT_RATE_LIMIT_ROOM_RATE = float(getenv('CHAT_RATE_LIMIT_ROOM_RATE', 20.0))
+CHAT_RATE_LIMIT_ROOM_BURST = int(getenv('CHAT_RATE_LIMIT_ROOM_BURST', 50))
+
+# Chat metrics are counted per process and added to a Redis hash every
+# FLUSH_INTERVAL seconds; "manage.py chat_metrics" reads them. Per-process
+# reports (e.g. the deepest outboxes) keep at most REPORT_ROWS rows.
+METRICS_FLUSH_INTERVAL = float(getenv('METRICS_FLUSH_INTERVAL', 10))
+METRICS_REPORT_ROWS = int(getenv('METRICS_REPORT_ROWS', 20))
+
+# Per-connection outbound queue: above HIGH_WATER frames typing events are
+# dropped; at LIMIT the socket is closed and the client told to resync. A
+# client that acks gets at most WINDOW frames ahead of its acks.
+CHAT_OUTBOX_HIGH_WATER = int(getenv('CHAT_OUTBOX_HIGH_WATER', 100))
+CHAT_OUTBOX_LIMIT = int(getenv('CHAT_OUTBOX_LIMIT', 1000))
+CHAT_OUTBOX_WINDOW = int(getenv('CHAT_OUTBOX_WINDOW', 64))
+
+# Typing indicators: an entry expires TTL seconds after the client's last
+# typing event; each room gets at most one update per BROADCAST_INTERVAL.
+CHAT_TYPING_TTL = int(getenv('CHAT_TYPING_TTL', 5))
+CHAT_TYPING_BROADCAST_INTERVAL = float(getenv('CHAT_TYPING_BROADCAST_INTERVAL', 0.5))
+
+# Message retention per chat type, in months (0 keeps history forever). Applied
+# by "manage.py partition_messages archive", which exports expired messages
+# to gzipped CSVs in CHAT_ARCHIVE_DIR before dropping them.
+CHAT_RETENTION_MONTHS = {
+    'global': int(getenv('CHAT_RETENTION_GLOBAL_MONTHS', 0)),
+    'group': int(getenv('CHAT_RETENTION_GROUP_MONTHS', 0)),
+    'private': int(getenv('CHAT_RETENTION_PRIVATE_MONTHS', 0)),
+}
+CHAT_ARCHIVE_DIR = getenv('CHAT_ARCHIVE_DIR', str(BASE_DIR / 'archive'))
+
+# History pages and reconnect replay first look back at most this many days
+# from their cursor (or the room's last message), so a partitioned messages
+# table only scans its newest partitions. Older rows take a second query,
+# only when the window comes up short.
+CHAT_HISTORY_WINDOW_DAYS = int(getenv('CHAT_HISTORY_WINDOW_DAYS', 7))
+
+# Read-through cache for hot chat/profile lookups: entries live READ_CACHE_TIMEOUT
+# seconds in Redis, plus up to READ_CACHE_LOCAL_SIZE per process for
+# READ_CACHE_LOCAL_TTL seconds (the most another process can serve stale data).
+READ_CACHE_TIMEOUT = int(getenv('READ_CACHE_TIMEOUT', 300))
+READ_CACHE_LOCAL_SIZE = int(getenv('READ_CACHE_LOCAL_SIZE', 1024))
+READ_CACHE_LOCAL_TTL = float(getenv('READ_CACHE_LOCAL_TTL', 5))
+
 CACHES = {
     'default': {
         'BACKEND': 'django_redis.cache.RedisCache',
-        'LOCATION': getenv('UPSTASH_REDIS_URL', 'redis://127.0.0.1:6379/1'),
+        'LOCATION': REDIS_URL,
         'OPTIONS': {
             "CLIENT_CLASS": "django_redis.client.DefaultClient",
         },
@@ -144,6 +225,31 @@ DATABASES = {
     }
 }
 
+# psycopg 3 connection pool, shared by all of a process' threads instead of
+# one connection per database_sync_to_async worker. Needs CONN_MAX_AGE = 0.
+if getenv('DATABASE_POOL', 'True') == 'True':
+    DATABASES['default']['OPTIONS'] = {
+        'pool': {
+            'min_size': int(getenv('DATABASE_POOL_MIN_SIZE', 2)),
+            'max_size': int(getenv('DATABASE_POOL_MAX_SIZE', 10)),
+            'timeout': int(getenv('DATABASE_POOL_TIMEOUT', 10)),
+        },
+    }
+
+# Optional read replica for history, sidebars, search and profiles (see
+# Pinggo.db_router). A user who wrote something reads from the primary for
+# at least REPLICA_STICKY_SECONDS afterwards.
+if getenv('DATABASE_REPLICA_HOST'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'HOST': getenv('DATABASE_REPLICA_HOST'),
+        'PORT': getenv('DATABASE_REPLICA_PORT', DATABASES['default']['PORT']),
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['Pinggo.db_router.ReplicaRouter']
+REPLICA_STICKY_SECONDS = int(getenv('REPLICA_STICKY_SECONDS', 5))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
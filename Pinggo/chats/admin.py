@@ -1,7 +1,8 @@
 from django.contrib import admin
 
-from .models import ChatGroup, GroupMessage
+from .models import ChatGroup, ChatMembership, GroupMessage
 
 # Register your models here.
 admin.site.register(ChatGroup)
 admin.site.register(GroupMessage)
+admin.site.register(ChatMembership)
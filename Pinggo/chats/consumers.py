@@ -1,11 +1,30 @@
 from channels.generic.websocket import AsyncWebsocketConsumer
-from django.template.loader import render_to_string
 from channels.db import database_sync_to_async
-import json
+from django.conf import settings
+from django.template.loader import render_to_string
+from collections import deque
+import asyncio
+import logging
+import math
+import time
 
-from .presence import Presence
+from . import protocol
+from .outbox import MESSAGE, PRESENCE, TYPING, Outbox
+from .ratelimit import RateLimiter
+from .presence import AsyncPresence, render_online_count, schedule_online_count
+from .replay import ReplayBuffer
+from .typing import AsyncTyping, schedule_typing
+from .utility import room_group_name
 from .service.chat_service import ChatService
 from .service.message_service import MessageService
+from users.services.user_service import UserService
+
+
+logger = logging.getLogger(__name__)
+
+FORBIDDEN_CLOSE_CODE = 4403
+CHAT_DELETED_CLOSE_CODE = 4404
+RESYNC_CLOSE_CODE = 4409
 
 
 class ChatroomConsumer(AsyncWebsocketConsumer):
@@ -14,75 +33,283 @@ class ChatroomConsumer(AsyncWebsocketConsumer):
         self.user = self.scope["user"]
         self.chatroom_type = self.scope["url_route"]["kwargs"]["chatroom_type"]
         self.chatroom_name = self.scope["url_route"]["kwargs"]["chatroom_name"]
+        self.room_group_name = room_group_name(self.chatroom_type, self.chatroom_name)
+        self.online_count = None
+        self.heartbeat_task = None
+        self.last_seq = 0
+        self.delivered = deque(maxlen=settings.CHAT_REPLAY_LIMIT * 2)
+        self.protocol, subprotocol = protocol.negotiate(self.scope)
+        self.joined = False
+        self.typing_since = None
+
+        if not self.user.is_authenticated:
+            await self.close()
+            return
+
+        # Cached user with its profile: rendering this user's messages then
+        # never queries for the author's name or avatar.
+        self.user = await UserService.async_get_user_with_profile(self.user.id)
+
+        if self.user is None:
+            await self.close()
+            return
 
+        # One query resolves the chat and the user's membership. The result is
+        # kept for the whole session, so messages never re-check it; membership
+        # changes arrive as membership_handler events instead.
+        self.chatroom = await ChatService.async_authorize(self.chatroom_type, self.chatroom_name, self.user)
 
-        self.chatroom = await ChatService.async_get_chat(self.chatroom_name)
+        if not self.is_authorized():
+            await self.close()
+            return
 
+        self.joined = True
+        self.outbox = Outbox(
+            self,
+            self.room_group_name,
+            high_water=settings.CHAT_OUTBOX_HIGH_WATER,
+            limit=settings.CHAT_OUTBOX_LIMIT,
+            overflow_code=RESYNC_CLOSE_CODE,
+            window=settings.CHAT_OUTBOX_WINDOW,
+        )
         await self.channel_layer.group_add(
-            f"{self.chatroom_type}-{self.chatroom_name}",
+            self.room_group_name,
             self.channel_name
         )
 
-        await self.accept()
+        await self.accept(subprotocol=subprotocol)
+
+        count = await AsyncPresence.add(self.chatroom_type, self.chatroom_name, self.user.id, self.channel_name)
 
-        Presence.add(self.chatroom_type ,self.chatroom_name, self.user.id)
+        # The newcomer gets the count right away; the rest of the room gets
+        # it with the next coalesced broadcast.
+        self.online_count = count - 1
+        self.send_frame(
+            render_online_count(self.online_count),
+            {"type": "presence", "count": self.online_count},
+            kind=PRESENCE,
+        )
         await self.broadcast_online_user_count()
 
+        self.heartbeat_task = asyncio.create_task(self.heartbeat())
+
+
+    def is_authorized(self):
+        if self.chatroom is None:
+            return False
+        return self.chatroom.chat_type == "global" or self.chatroom.is_member
+
+
+    async def membership_handler(self, event):
+        if self.user.id in event["removed"]:
+            self.chatroom.is_member = False
+        elif self.user.id in event["added"]:
+            self.chatroom.is_member = True
+
+        if not self.is_authorized():
+            self.outbox.close(FORBIDDEN_CLOSE_CODE)
+
+
+    async def chat_deleted_handler(self, event):
+        self.outbox.close(CHAT_DELETED_CLOSE_CODE)
+
+
+    async def chat_renamed_handler(self, event):
+        # The room's group name changed; the client has to reconnect under
+        # the new name.
+        self.outbox.close(RESYNC_CLOSE_CODE)
+
+
+    def send_frame(self, html, payload, kind=MESSAGE):
+        """
+        Queue one server event in the socket's negotiated protocol: the HTML
+        fragment for HTMX clients, the compact payload for everyone else.
+        """
+        if self.protocol == protocol.HTML:
+            self.outbox.put(kind, {"text_data": html})
+        else:
+            self.outbox.put(kind, protocol.encode(self.protocol, payload))
+
 
     async def receive(self, text_data=None, bytes_data=None):
-        data = json.loads(text_data)
+        data = protocol.decode(text_data, bytes_data)
+
+        if data.get("type") == "ack":
+            self.outbox.ack(int(data.get("count") or 0))
+            return
+
+        # A member removed mid-session keeps the socket until the outbox
+        # flushes its 4403 close; nothing they send gets through meanwhile.
+        if not self.is_authorized():
+            return
+
+        if data.get("type") == "resume":
+            await self.resume(int(data.get("last_seq") or 0))
+            return
+
+        if data.get("type") == "typing":
+            await self.typing_started()
+            return
+
+        if data.get("type") == "typing_stop":
+            await self.typing_stopped()
+            return
+
         body = data["message"]
 
+        retry_after = await RateLimiter.check(self.user.id, self.room_group_name)
+
+        if retry_after is not None:
+            self.send_frame(
+                render_to_string("chats/partials/chat_notice.html", {"retry_after": math.ceil(retry_after)}),
+                {"type": "error", "code": "rate_limited", "retry_after": retry_after},
+            )
+            return
+
         message = await MessageService.create_message(
             user=self.user,
             group=self.chatroom,
             message=body,
         )
 
-        await self.channel_layer.group_send(
-            f"{self.chatroom_type}-{self.chatroom_name}",
-            {
-                "type": "message_handler",
-                "message_id": message.id,
-            }
+        await MessageService.publish(message, self.chatroom_type, self.chatroom_name)
+        await self.typing_stopped()
+
+
+    async def typing_started(self):
+        # Clients repeat "typing" while the user types; refreshing the entry
+        # once per third of its TTL is enough to keep it alive.
+        now = time.monotonic()
+        if self.typing_since is not None and now - self.typing_since < settings.CHAT_TYPING_TTL / 3:
+            return
+
+        self.typing_since = now
+        await AsyncTyping.start(self.chatroom_type, self.chatroom_name, self.user.id)
+        await schedule_typing(self.chatroom_type, self.chatroom_name)
+
+
+    async def typing_stopped(self):
+        if self.typing_since is None:
+            return
+
+        self.typing_since = None
+        await AsyncTyping.stop(self.chatroom_type, self.chatroom_name, self.user.id)
+        await schedule_typing(self.chatroom_type, self.chatroom_name)
+
+
+    async def typing_handler(self, event):
+        if self.user.id in event["user_ids"]:
+            html = event["typer_html"]
+            count = len(event["user_ids"]) - 1
+        else:
+            html = event["html"]
+            count = len(event["user_ids"])
+
+        self.send_frame(html, {"type": "typing", "count": count, "user_ids": event["user_ids"]}, kind=TYPING)
+
+
+    async def resume(self, last_seq):
+        """
+        Replay what the client missed while disconnected: from the Redis
+        ring buffer when it still reaches back far enough, else from the
+        database. Too large a gap gets a resync close so the client reloads.
+        """
+        events = await ReplayBuffer.since(self.chatroom.id, last_seq)
+
+        if events is not None:
+            if len(events) > settings.CHAT_REPLAY_LIMIT:
+                self.outbox.close(RESYNC_CLOSE_CODE)
+                return
+
+            for event in events:
+                if event["seq"] not in self.delivered:
+                    await self.message_handler(event)
+            return
+
+        messages = await database_sync_to_async(MessageService.get_messages_since)(
+            self.chatroom, last_seq, settings.CHAT_REPLAY_LIMIT + 1
         )
 
+        if len(messages) > settings.CHAT_REPLAY_LIMIT:
+            self.outbox.close(RESYNC_CLOSE_CODE)
+            return
+
+        for message in messages:
+            if message.seq in self.delivered:
+                continue
+
+            if self.protocol == protocol.HTML:
+                html = await database_sync_to_async(MessageService.render_message)(
+                    message, self.chatroom_type, self.user
+                )
+                self.outbox.put(MESSAGE, {"text_data": html})
+            else:
+                payload = await database_sync_to_async(MessageService.serialize_message)(message)
+                self.outbox.put(MESSAGE, protocol.encode(self.protocol, {"type": "message", **payload}))
+
+            self.mark_delivered(message.seq)
+
+
+    def mark_delivered(self, seq):
+        if seq is not None:
+            self.delivered.append(seq)
+            self.last_seq = max(self.last_seq, seq)
+
 
     async def message_handler(self, event):
-        message = await MessageService.get_message(
-            message_id=event["message_id"]
-        )
+        self.mark_delivered(event["seq"])
+
+        if event["author_id"] == self.user.id:
+            html = event["own_html"]
+        else:
+            html = event["other_html"]
+
+        self.send_frame(html, {"type": "message", **event["data"]})
 
-        html = await database_sync_to_async(render_to_string)(
-            "chats/partials/chat_message_p.html",
-            {
-                "message": message,
-                "user": self.user,
-            }
-        )
 
-        await self.send(text_data=html)
+    async def heartbeat(self):
+        while True:
+            await asyncio.sleep(settings.PRESENCE_HEARTBEAT_INTERVAL)
+
+            # One failed beat must not end the task: the socket would stay
+            # open but stop refreshing, and be reaped as dead.
+            try:
+                count = await AsyncPresence.heartbeat(
+                    self.chatroom_type, self.chatroom_name, self.user.id, self.channel_name
+                )
+
+                # Reaping dead connections can change the count without anyone
+                # connecting or leaving, so let the room know.
+                if count - 1 != self.online_count:
+                    await self.broadcast_online_user_count()
+            except Exception:
+                logger.exception("Presence heartbeat failed for %s", self.channel_name)
 
 
     async def disconnect(self, close_code):
+        if not self.joined:
+            return
+
+        if self.heartbeat_task:
+            self.heartbeat_task.cancel()
+
+        self.outbox.stop()
+        await self.typing_stopped()
+
+        if self.chatroom.chat_type != "global" and self.last_seq:
+            await ChatService.async_mark_read(self.chatroom, self.user.id, self.last_seq)
+
         await self.channel_layer.group_discard(
-            f"{self.chatroom_type}-{self.chatroom_name}",
+            self.room_group_name,
             self.channel_name
         )
 
-        Presence.remove(self.chatroom_type, self.chatroom_name, self.user.id)
+        await AsyncPresence.remove(self.chatroom_type, self.chatroom_name, self.user.id, self.channel_name)
         await self.broadcast_online_user_count()
 
     async def broadcast_online_user_count(self):
-        count = Presence.count(self.chatroom_type, self.chatroom_name) - 1
-        await self.channel_layer.group_send(
-            f"{self.chatroom_type}-{self.chatroom_name}",
-            {
-                "type": "online_count_handler",
-                "count": count,
-            }
-        )
+        await schedule_online_count(self.chatroom_type, self.chatroom_name)
 
     async def online_count_handler(self, event):
-        html = await database_sync_to_async(render_to_string)("chats/partials/online_count.html", {"count": event["count"]})
-        await self.send(text_data=html)
+        self.online_count = event["count"]
+        self.send_frame(event["html"], {"type": "presence", "count": event["count"]}, kind=PRESENCE)
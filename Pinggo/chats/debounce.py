@@ -0,0 +1,49 @@
+import asyncio
+
+from .redis_client import get_async_redis
+
+
+class RoomDebouncer:
+    """
+    Trailing-edge debounce per room, shared across Daphne nodes.
+
+    The first caller in a window takes a Redis lock and schedules the
+    callback for when the window closes; every other call in that window is
+    a no-op. The lock is released right before the callback runs, so a
+    change that lands while it is running opens a new window instead of
+    being lost.
+    """
+
+    def __init__(self, name, interval):
+        self.name = name
+        self.interval = interval
+        self.pending = set()
+        self.tasks = set()
+
+    def key(self, room):
+        return f"debounce:{self.name}:{room}"
+
+    async def schedule(self, room, callback):
+        if room in self.pending:
+            return
+
+        acquired = await get_async_redis().set(
+            self.key(room), 1, nx=True, px=int(self.interval * 1000)
+        )
+
+        if not acquired:
+            return
+
+        self.pending.add(room)
+        task = asyncio.create_task(self.fire(room, callback))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def fire(self, room, callback):
+        try:
+            await asyncio.sleep(self.interval)
+        finally:
+            self.pending.discard(room)
+            await get_async_redis().delete(self.key(room))
+
+        await callback()
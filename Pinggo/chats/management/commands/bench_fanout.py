@@ -0,0 +1,99 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+import time
+
+
+ROOM_PREFIX = "bench-fanout-"
+
+
+class Command(BaseCommand):
+    help = "Time the per-message cost of fanning a chat message out to a room of each size"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", default="10,100,1000,2000", help="Comma-separated room sizes")
+        parser.add_argument("--messages", type=int, default=5, help="Messages sent per room size")
+        parser.add_argument("--cleanup", action="store_true", help="Delete the seeded data and exit")
+
+    def handle(self, *args, **options):
+        from chats.models import ChatGroup
+
+        if options["cleanup"]:
+            count, _ = ChatGroup.objects.filter(group_name__startswith=ROOM_PREFIX).delete()
+            User.objects.filter(username__startswith=ROOM_PREFIX).delete()
+            self.stdout.write(self.style.SUCCESS(f"Deleted {count} rows"))
+            return
+
+        messages = self.seed(options["messages"])
+        author = messages[0].author
+
+        self.stdout.write(f"{'room size':>10}  {'per-socket':>28}  {'per-room':>28}")
+
+        for size in (int(size) for size in options["sizes"].split(",")):
+            # Sockets only need a user to compare against the author; one of
+            # them is the author's own tab.
+            viewers = [author] + [User(id=-i, username=f"{ROOM_PREFIX}{i}") for i in range(1, size)]
+
+            per_socket = self.measure(messages, lambda message: self.per_socket(message, viewers))
+            per_room = self.measure(messages, lambda message: self.per_room(message, viewers))
+
+            self.stdout.write(f"{size:>10}  {per_socket:>28}  {per_room:>28}")
+
+    def seed(self, count):
+        from chats.models import ChatGroup, GroupMessage
+
+        author, _ = User.objects.get_or_create(username=f"{ROOM_PREFIX}author")
+        room, _ = ChatGroup.objects.get_or_create(
+            group_name=f"{ROOM_PREFIX}room", defaults={"chat_type": "group", "creator": author}
+        )
+
+        messages = list(GroupMessage.objects.filter(group=room).order_by("seq")[:count])
+        if len(messages) < count:
+            messages += GroupMessage.objects.bulk_create(
+                GroupMessage(group=room, author=author, message=f"Fan-out message {seq}", seq=seq)
+                for seq in range(len(messages) + 1, count + 1)
+            )
+            ChatGroup.objects.filter(pk=room.pk).update(last_seq=count)
+
+        for message in messages:
+            message.author = author
+        return messages
+
+    @staticmethod
+    def per_socket(message, viewers):
+        """
+        The old fan-out: the event carried only the message id, and every
+        socket loaded the message and rendered it for its own user.
+        """
+        from chats.models import GroupMessage
+        from chats.service.message_service import MessageService
+
+        for viewer in viewers:
+            loaded = GroupMessage.objects.select_related("author__profile").get(id=message.id)
+            MessageService.render_message(loaded, "group", viewer)
+
+    @staticmethod
+    def per_room(message, viewers):
+        """
+        The sender renders both variants once; each socket, like
+        ChatroomConsumer.message_handler, only picks one.
+        """
+        from chats.service.message_service import MessageService
+
+        event = MessageService.build_message_event(message, "group")
+        for viewer in viewers:
+            event["own_html"] if event["author_id"] == viewer.id else event["other_html"]
+
+    @staticmethod
+    def measure(messages, send):
+        with CaptureQueriesContext(connection) as queries:
+            began = time.perf_counter()
+            for message in messages:
+                send(message)
+            elapsed = (time.perf_counter() - began) * 1000
+
+        return (
+            f"{len(queries) / len(messages):.1f} queries, "
+            f"{elapsed / len(messages):.1f} ms/msg"
+        )
@@ -0,0 +1,117 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+import statistics
+import time
+
+
+ROOM_PREFIX = "bench-history-"
+
+
+class Command(BaseCommand):
+    help = "Seed one large room and time OFFSET against keyset history pages at increasing depth"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=1_000_000)
+        parser.add_argument(
+            "--depths",
+            default="0,1000,10000,100000,500000",
+            help="Comma-separated numbers of messages to scroll back past",
+        )
+        parser.add_argument("--repeat", type=int, default=5, help="Timed runs per depth")
+        parser.add_argument("--cleanup", action="store_true", help="Delete the seeded data and exit")
+
+    def handle(self, *args, **options):
+        from chats.models import ChatGroup
+
+        if options["cleanup"]:
+            count, _ = ChatGroup.objects.filter(group_name__startswith=ROOM_PREFIX).delete()
+            User.objects.filter(username__startswith=ROOM_PREFIX).delete()
+            self.stdout.write(self.style.SUCCESS(f"Deleted {count} rows"))
+            return
+
+        room = self.seed(options["messages"])
+        total = room.last_seq
+
+        self.stdout.write(f"{'depth':>10}  {'offset p50':>12}  {'keyset p50':>12}")
+
+        for depth in (int(depth) for depth in options["depths"].split(",")):
+            if depth >= total:
+                self.stdout.write(self.style.WARNING(f"{depth:>10}  skipped: room has {total} messages"))
+                continue
+
+            offset = self.time(options["repeat"], lambda: self.offset_page(room, depth))
+            before = self.cursor_at(room, depth)
+            keyset = self.time(options["repeat"], lambda: self.keyset_page(room, before))
+
+            self.stdout.write(f"{depth:>10}  {offset:>9.1f} ms  {keyset:>9.1f} ms")
+
+    def seed(self, count):
+        from chats.models import ChatGroup, GroupMessage
+
+        author, _ = User.objects.get_or_create(username=f"{ROOM_PREFIX}author")
+        room, created = ChatGroup.objects.get_or_create(
+            group_name=f"{ROOM_PREFIX}room", defaults={"chat_type": "group", "creator": author}
+        )
+
+        if not created:
+            self.stdout.write("Reusing seeded data (run with --cleanup to reseed)")
+            return room
+
+        self.stdout.write(f"Seeding {count} messages...")
+
+        # Generated server side: a million-row room is out of reach for
+        # bulk_create in any reasonable time.
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {GroupMessage._meta.db_table} "
+                f"(group_id, author_id, message, file_url, file_type, file_name, created_at, seq) "
+                f"SELECT %s, %s, 'History message ' || n, '', '', '', "
+                f"now() - make_interval(secs => %s - n), n "
+                f"FROM generate_series(1, %s) AS n",
+                [room.pk, author.pk, count, count],
+            )
+            cursor.execute(f"ANALYZE {GroupMessage._meta.db_table}")
+
+        ChatGroup.objects.filter(pk=room.pk).update(last_seq=count)
+        room.last_seq = count
+        return room
+
+    @staticmethod
+    def offset_page(room, depth):
+        """
+        The old scroll-back: skip ``depth`` rows, then read a page.
+        """
+        from chats.service.chat_service import MESSAGE_PAGE_SIZE
+
+        return list(
+            room.chat_messages.select_related("author__profile")
+            .order_by("-created_at", "-id")[depth:depth + MESSAGE_PAGE_SIZE]
+        )
+
+    @staticmethod
+    def cursor_at(room, depth):
+        """
+        The cursor a client holds after scrolling back past ``depth``
+        messages: the oldest message it has loaded.
+        """
+        if not depth:
+            return None
+
+        message = room.chat_messages.get(seq=room.last_seq - depth + 1)
+        return message.created_at, message.id
+
+    @staticmethod
+    def keyset_page(room, before):
+        from chats.service.chat_service import ChatService
+
+        return ChatService.get_chat_messages(room, before=before)
+
+    @staticmethod
+    def time(repeat, load):
+        timings = []
+        for _ in range(repeat):
+            began = time.perf_counter()
+            load()
+            timings.append((time.perf_counter() - began) * 1000)
+        return statistics.median(timings)
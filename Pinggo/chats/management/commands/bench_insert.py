@@ -0,0 +1,130 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+import asyncio
+import statistics
+import time
+
+
+ROOM_PREFIX = "bench-insert-"
+
+
+class Command(BaseCommand):
+    help = "Time the per-message cost of storing a chat message"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=2000, help="Messages stored per path")
+        parser.add_argument("--members", type=int, default=50, help="Members in the benchmark room")
+        parser.add_argument(
+            "--write-behind",
+            action="store_true",
+            help="Also time the CHAT_WRITE_BEHIND path (needs Redis)",
+        )
+        parser.add_argument("--cleanup", action="store_true", help="Delete the seeded data and exit")
+
+    def handle(self, *args, **options):
+        from chats.models import ChatGroup
+
+        if options["cleanup"]:
+            count, _ = ChatGroup.objects.filter(group_name__startswith=ROOM_PREFIX).delete()
+            User.objects.filter(username__startswith=ROOM_PREFIX).delete()
+            self.stdout.write(self.style.SUCCESS(f"Deleted {count} rows"))
+            return
+
+        author, room = self.seed(options["members"])
+
+        for label, store in (
+            ("validated", self.validated),
+            ("unchecked", self.unchecked),
+        ):
+            self.report(label, *self.bench(store, author, room, options["messages"]))
+
+        if options["write_behind"]:
+            self.report("write-behind", *asyncio.run(self.write_behind(author, room, options["messages"])))
+
+    def seed(self, members):
+        from chats.models import ChatGroup
+
+        author, _ = User.objects.get_or_create(username=f"{ROOM_PREFIX}author")
+        room, created = ChatGroup.objects.get_or_create(
+            group_name=f"{ROOM_PREFIX}room", defaults={"chat_type": "group", "creator": author}
+        )
+
+        if created:
+            room.members.add(*User.objects.bulk_create(
+                User(username=f"{ROOM_PREFIX}{i}") for i in range(1, members)
+            ))
+
+        return author, room
+
+    @staticmethod
+    def validated(user, group, text):
+        """
+        The consumer path before the unchecked insert: save() runs
+        full_clean(), and with it the membership query.
+        """
+        from chats.models import GroupMessage
+        from chats.service.message_service import MessageService
+
+        with transaction.atomic():
+            chat_message = GroupMessage(message=text, author=user, group=group)
+            chat_message.seq = MessageService.next_seq(group, chat_message)
+            chat_message.save(force_insert=True)
+
+    @staticmethod
+    def unchecked(user, group, text):
+        from chats.service.message_service import MessageService
+
+        MessageService.create_message_unchecked(user, group, text)
+
+    @staticmethod
+    def bench(store, author, room, count):
+        timings = []
+        queries = 0
+
+        def count_query(execute, *args):
+            nonlocal queries
+            queries += 1
+            return execute(*args)
+
+        with connection.execute_wrapper(count_query):
+            for i in range(count):
+                began = time.perf_counter()
+                store(author, room, f"Insert benchmark message {i}")
+                timings.append((time.perf_counter() - began) * 1000)
+
+        return timings, sum(timings), f"{queries / len(timings):.1f} queries/msg"
+
+    @staticmethod
+    async def write_behind(author, room, count):
+        """
+        Latency is what the consumer waits for (an id and a seq); msg/s is
+        measured until the last row is in the database.
+        """
+        from chats.service.write_behind import message_write_behind
+
+        timings = []
+        started = time.perf_counter()
+
+        for i in range(count):
+            began = time.perf_counter()
+            await message_write_behind.create_message(author, room, f"Insert benchmark message {i}")
+            timings.append((time.perf_counter() - began) * 1000)
+
+        while message_write_behind.pending or message_write_behind.inflight:
+            message_write_behind.wakeup.set()
+            await asyncio.sleep(0.01)
+
+        elapsed = (time.perf_counter() - started) * 1000
+        message_write_behind.flusher.cancel()
+        return timings, elapsed, "written in batches"
+
+    def report(self, label, timings, elapsed, queries):
+        timings.sort()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{label}: {len(timings)} messages, {queries}, "
+            f"p50 {statistics.median(timings):.2f} ms, "
+            f"p95 {timings[int(len(timings) * 0.95) - 1]:.2f} ms, "
+            f"{len(timings) / (elapsed / 1000):.0f} msg/s"
+        ))
@@ -0,0 +1,128 @@
+from channels.layers import get_channel_layer
+from collections import Counter
+from django.conf import settings
+from django.core.management.base import BaseCommand
+import asyncio
+import random
+import time
+
+
+ROOM_PREFIX = "bench-presence-"
+
+
+class Command(BaseCommand):
+    help = "Simulate a reconnect storm and count the online-count broadcasts and Redis calls it costs"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--clients", type=int, default=5000)
+        parser.add_argument("--rooms", type=int, default=10)
+        parser.add_argument("--nodes", type=int, default=4, help="Daphne processes the clients are spread over")
+        parser.add_argument("--window", type=float, default=2.0, help="Seconds over which every client reconnects")
+        parser.add_argument("--seed", type=int, default=42)
+
+    def handle(self, *args, **options):
+        asyncio.run(self.storm(random.Random(options["seed"]), options))
+
+    async def storm(self, rng, options):
+        from chats.debounce import RoomDebouncer
+        from chats.presence import AsyncPresence, presence_key
+        from chats.redis_client import get_async_redis
+
+        redis = get_async_redis()
+        layer = get_channel_layer()
+        rooms = [f"{ROOM_PREFIX}{i}" for i in range(options["rooms"])]
+        clients = [
+            (rooms[i % len(rooms)], i + 1, f"{ROOM_PREFIX}{i}")
+            for i in range(options["clients"])
+        ]
+        # Each process has its own debouncer; only the Redis lock is shared.
+        nodes = [
+            RoomDebouncer("online-count", settings.PRESENCE_BROADCAST_INTERVAL)
+            for _ in range(options["nodes"])
+        ]
+        # Stay inside the client's connection pool.
+        slots = asyncio.Semaphore(max(settings.REDIS_MAX_CONNECTIONS // 2, 1))
+
+        async def bounded(call):
+            async with slots:
+                return await call
+
+        await asyncio.gather(*(
+            bounded(AsyncPresence.add("group", room, user_id, channel))
+            for room, user_id, channel in clients
+        ))
+
+        commands = Counter()
+        broadcasts = Counter()
+        execute_command, group_send = redis.execute_command, layer.group_send
+
+        async def count_command(*args, **kwargs):
+            commands[args[0]] += 1
+            return await execute_command(*args, **kwargs)
+
+        async def count_broadcast(group, message):
+            broadcasts[group] += 1
+            return await group_send(group, message)
+
+        redis.execute_command, layer.group_send = count_command, count_broadcast
+
+        try:
+            began = time.perf_counter()
+            await asyncio.gather(*(
+                self.reconnect(rng, nodes[i % len(nodes)], bounded, options["window"], *client)
+                for i, client in enumerate(clients)
+            ))
+            # Trailing broadcasts still waiting for their window to close.
+            await asyncio.gather(*(task for node in nodes for task in list(node.tasks)))
+            elapsed = time.perf_counter() - began
+        finally:
+            redis.execute_command, layer.group_send = execute_command, group_send
+            for room in rooms:
+                key = presence_key("group", room)
+                await redis.delete(key, f"{key}:users", f"{key}:reaper")
+
+        self.report(options, rooms, clients, broadcasts, commands, elapsed)
+
+    @staticmethod
+    async def reconnect(rng, node, bounded, window, room, user_id, channel):
+        """
+        What ChatroomConsumer.disconnect and connect do for presence, with
+        the reconnected socket under a new channel name.
+        """
+        from chats.presence import AsyncPresence, broadcast_online_count
+        from chats.utility import room_group_name
+
+        def schedule():
+            return node.schedule(
+                room_group_name("group", room),
+                lambda: broadcast_online_count("group", room),
+            )
+
+        await asyncio.sleep(rng.uniform(0, window))
+        await bounded(AsyncPresence.remove("group", room, user_id, channel))
+        await bounded(schedule())
+        await bounded(AsyncPresence.add("group", room, user_id, f"{channel}-again"))
+        await bounded(schedule())
+
+    def report(self, options, rooms, clients, broadcasts, commands, elapsed):
+        members = len(clients) / len(rooms)
+        per_room = [broadcasts[group] for group in sorted(broadcasts)] or [0]
+        sent = sum(per_room)
+
+        self.stdout.write(
+            f"{len(clients)} clients in {len(rooms)} rooms on {options['nodes']} nodes "
+            f"reconnected within {options['window']:.1f} s ({elapsed:.1f} s with trailing broadcasts)"
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Broadcasts per room: min {min(per_room)}, max {max(per_room)}; "
+            f"{sent} in total, {sent * members:.0f} frames delivered"
+        ))
+        # Every connect and disconnect used to broadcast straight away.
+        self.stdout.write(
+            f"Without coalescing: {2 * len(clients)} broadcasts, "
+            f"{2 * len(clients) * members:.0f} frames delivered"
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Redis calls: {commands.total()} ({commands.total() / len(clients):.1f} per reconnect): "
+            + ", ".join(f"{name} {count}" for name, count in commands.most_common())
+        ))
@@ -0,0 +1,124 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+import random
+import time
+
+from chats.management.commands.bench_search import WORDS
+
+
+ROOM_PREFIX = "bench-protocol-"
+
+
+class Command(BaseCommand):
+    help = "Compare frame size and CPU cost of the html, json and msgpack socket protocols"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=1000)
+        parser.add_argument("--files", type=float, default=0.1, help="Share of messages with an attachment")
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--cleanup", action="store_true", help="Delete the seeded data and exit")
+
+    def handle(self, *args, **options):
+        from chats import protocol
+        from chats.models import ChatGroup
+
+        if options["cleanup"]:
+            count, _ = ChatGroup.objects.filter(group_name__startswith=ROOM_PREFIX).delete()
+            User.objects.filter(username__startswith=ROOM_PREFIX).delete()
+            self.stdout.write(self.style.SUCCESS(f"Deleted {count} rows"))
+            return
+
+        messages = self.seed(random.Random(options["seed"]), options)
+        per_thousand = 1000 / len(messages)
+
+        self.stdout.write(
+            f"{len(messages)} messages; CPU in ms per 1000 messages. "
+            f"build: model to frame, once per message; encode: per socket; decode: on the client."
+        )
+        self.stdout.write(f"{'protocol':>10}  {'bytes/frame':>12}  {'build':>8}  {'encode':>8}  {'decode':>8}")
+
+        for name in (protocol.HTML, protocol.JSON, protocol.MSGPACK):
+            build, payloads = self.cpu(lambda: [self.build(name, message) for message in messages])
+            encode, frames = self.cpu(lambda: [self.encode(name, payload) for payload in payloads])
+            size = sum(len(self.frame_bytes(frame)) for frame in frames) / len(frames)
+
+            if name == protocol.HTML:
+                decode = "n/a"
+            else:
+                decode, _ = self.cpu(lambda: [protocol.decode(**frame) for frame in frames])
+                decode = f"{decode * per_thousand:.1f}"
+
+            self.stdout.write(
+                f"{name:>10}  {size:>12.0f}  {build * per_thousand:>8.1f}  "
+                f"{encode * per_thousand:>8.1f}  {decode:>8}"
+            )
+
+    def seed(self, rng, options):
+        from chats.models import ChatGroup, GroupMessage
+        from users.models import Profile
+
+        author, _ = User.objects.get_or_create(username=f"{ROOM_PREFIX}author")
+        Profile.objects.filter(user=author).update(
+            displayname="Bench Author",
+            image_url="https://res.cloudinary.com/pinggo/image/upload/avatar/bench.png",
+        )
+        room, created = ChatGroup.objects.get_or_create(
+            group_name=f"{ROOM_PREFIX}room", defaults={"chat_type": "group", "creator": author}
+        )
+
+        if created:
+            batch = []
+            for seq in range(1, options["messages"] + 1):
+                message = GroupMessage(
+                    group=room,
+                    author=author,
+                    message=" ".join(rng.choices(WORDS, k=rng.randint(3, 30))),
+                    seq=seq,
+                )
+                if rng.random() < options["files"]:
+                    message.file_url = f"https://res.cloudinary.com/pinggo/image/upload/chat/files/{seq}.png"
+                    message.file_type = "image"
+                    message.file_name = f"{seq}.png"
+                batch.append(message)
+
+            GroupMessage.objects.bulk_create(batch)
+            ChatGroup.objects.filter(pk=room.pk).update(last_seq=options["messages"])
+
+        return list(
+            GroupMessage.objects.filter(group=room).select_related("author__profile")
+            .order_by("seq")[:options["messages"]]
+        )
+
+    @staticmethod
+    def build(name, message):
+        """
+        What the sender does once per message for this protocol: HTML
+        clients need the rendered bubble, structured ones the payload.
+        """
+        from chats import protocol
+        from chats.service.message_service import MessageService
+
+        if name == protocol.HTML:
+            return MessageService.render_message(message, "group", None)
+        return {"type": "message", **MessageService.serialize_message(message)}
+
+    @staticmethod
+    def encode(name, payload):
+        # As ChatroomConsumer.send_frame does for each socket.
+        from chats import protocol
+
+        if name == protocol.HTML:
+            return {"text_data": payload}
+        return protocol.encode(name, payload)
+
+    @staticmethod
+    def frame_bytes(frame):
+        if "bytes_data" in frame:
+            return frame["bytes_data"]
+        return frame["text_data"].encode()
+
+    @staticmethod
+    def cpu(work):
+        began = time.process_time()
+        result = work()
+        return (time.process_time() - began) * 1000, result
@@ -0,0 +1,135 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+from datetime import timedelta
+import random
+import statistics
+import time
+
+
+WORDS = (
+    "alpha bravo charlie delta echo foxtrot golf hotel india juliet kilo lima "
+    "mike november oscar papa quebec romeo sierra tango uniform victor whiskey "
+    "xray yankee zulu deploy release meeting lunch bug review coffee weekend "
+    "python django redis postgres socket server client cache index query"
+).split()
+
+ROOM_PREFIX = "bench-search-"
+
+
+class Command(BaseCommand):
+    help = "Seed chat messages and time full-text search over them"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=100_000)
+        parser.add_argument("--rooms", type=int, default=200)
+        parser.add_argument("--member-of", type=int, default=10)
+        parser.add_argument("--queries", type=int, default=50)
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--cleanup", action="store_true", help="Delete the seeded data and exit")
+
+    def handle(self, *args, **options):
+        from chats.models import ChatGroup
+
+        if options["cleanup"]:
+            count, _ = ChatGroup.objects.filter(group_name__startswith=ROOM_PREFIX).delete()
+            User.objects.filter(username__startswith=ROOM_PREFIX).delete()
+            self.stdout.write(self.style.SUCCESS(f"Deleted {count} rows"))
+            return
+
+        rng = random.Random(options["seed"])
+        user = self.seed(rng, options)
+        self.bench(rng, user, options)
+
+    def seed(self, rng, options):
+        from chats.models import ChatGroup, GroupMessage
+
+        user, _ = User.objects.get_or_create(username=f"{ROOM_PREFIX}user")
+
+        if ChatGroup.objects.filter(group_name__startswith=ROOM_PREFIX).exists():
+            self.stdout.write("Reusing seeded data (run with --cleanup to reseed)")
+            return user
+
+        self.stdout.write(f"Seeding {options['messages']} messages in {options['rooms']} rooms...")
+
+        rooms = ChatGroup.objects.bulk_create(
+            ChatGroup(group_name=f"{ROOM_PREFIX}{i}", chat_type="group", creator=user)
+            for i in range(options["rooms"])
+        )
+
+        for room in rng.sample(rooms, min(options["member_of"], len(rooms))):
+            room.members.add(user)
+
+        start = timezone.now() - timedelta(days=365)
+        seqs = dict.fromkeys((room.id for room in rooms), 0)
+        batch = []
+
+        for i in range(options["messages"]):
+            room = rng.choice(rooms)
+            seqs[room.id] += 1
+            batch.append(GroupMessage(
+                group=room,
+                author=user,
+                message=" ".join(rng.choices(WORDS, k=rng.randint(3, 20))),
+                created_at=start + timedelta(seconds=i),
+                seq=seqs[room.id],
+            ))
+
+            if len(batch) == 5000:
+                GroupMessage.objects.bulk_create(batch)
+                batch = []
+
+        GroupMessage.objects.bulk_create(batch)
+
+        with transaction.atomic():
+            for room_id, seq in seqs.items():
+                ChatGroup.objects.filter(pk=room_id).update(last_seq=seq)
+
+        with connection.cursor() as cursor:
+            cursor.execute(f"ANALYZE {GroupMessage._meta.db_table}")
+
+        return user
+
+    def bench(self, rng, user, options):
+        from chats.service.search_service import SearchService
+
+        timings = []
+        pages = 0
+
+        for i in range(options["queries"]):
+            text = " ".join(rng.sample(WORDS, rng.randint(1, 2)))
+
+            began = time.perf_counter()
+            results = SearchService.search_messages(user, text)
+            if results["has_more"]:
+                SearchService.search_messages(user, text, before=self.cursor(results))
+                pages += 1
+            timings.append((time.perf_counter() - began) * 1000)
+
+        timings.sort()
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(timings)} searches ({pages} with a second page): "
+            f"p50 {statistics.median(timings):.1f} ms, "
+            f"p95 {timings[int(len(timings) * 0.95) - 1]:.1f} ms, "
+            f"max {timings[-1]:.1f} ms"
+        ))
+
+        self.explain(user)
+
+    @staticmethod
+    def cursor(results):
+        last = results["messages"][-1]
+        return last.created_at, last.id
+
+    def explain(self, user):
+        from django.contrib.postgres.search import SearchQuery
+        from chats.models import SEARCH_CONFIG, GroupMessage
+        from chats.service.search_service import SearchService
+
+        query = GroupMessage.objects.filter(
+            group_id__in=SearchService.viewable_group_ids(user),
+            search_vector=SearchQuery("deploy", search_type="websearch", config=SEARCH_CONFIG),
+        ).order_by("-created_at", "-id")[:21]
+
+        self.stdout.write(query.explain(analyze=True))
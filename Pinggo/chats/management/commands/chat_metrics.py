@@ -0,0 +1,85 @@
+from django.core.management.base import BaseCommand
+import json
+
+from Pinggo.metrics import metrics
+
+
+class Command(BaseCommand):
+    help = "Show the chat metrics published by every process"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--json", action="store_true", help="Print as JSON")
+        parser.add_argument("--reset", action="store_true", help="Zero the counters after printing them")
+
+    def handle(self, *args, **options):
+        counters = metrics.totals()
+        outboxes = metrics.reports("outbox")
+        caches = metrics.reports("cache")
+
+        if options["json"]:
+            self.stdout.write(json.dumps(
+                {"counters": counters, "outboxes": outboxes, "caches": caches}, indent=2
+            ))
+        else:
+            self.write_counters(counters)
+            self.write_caches(counters, caches)
+            self.write_outboxes(outboxes)
+
+        if options["reset"]:
+            metrics.reset_totals()
+            self.stdout.write(self.style.SUCCESS("Counters reset"))
+
+    def write_counters(self, counters):
+        if not counters:
+            self.stdout.write("No counters published yet")
+            return
+
+        width = max(map(len, counters))
+        for name in sorted(counters):
+            self.stdout.write(f"{name:<{width}}  {counters[name]:>12}")
+
+    def write_caches(self, counters, caches):
+        """
+        Hit rate of each read-through cache over all processes, from the
+        ``cache.<namespace>.*`` counters.
+        """
+        namespaces = sorted({name.split(".")[1] for name in counters if name.startswith("cache.")})
+
+        if not namespaces:
+            return
+
+        self.stdout.write("")
+        self.stdout.write(f"{'cache':<16}  {'local':>10}  {'redis':>10}  {'misses':>10}  {'hit rate':>8}  {'local size':>10}")
+
+        for namespace in namespaces:
+            local, shared, misses = (
+                counters.get(f"cache.{namespace}.{outcome}", 0) for outcome in ("local_hits", "hits", "misses")
+            )
+            looked_up = local + shared + misses
+            rate = f"{(local + shared) / looked_up:.1%}" if looked_up else "-"
+            size = sum(report.get(namespace, {}).get("local_size", 0) for report in caches.values())
+
+            self.stdout.write(f"{namespace:<16}  {local:>10}  {shared:>10}  {misses:>10}  {rate:>8}  {size:>10}")
+
+    def write_outboxes(self, outboxes):
+        """
+        Per-connection queue depth, deepest first across all processes;
+        ``unacked`` is blank for clients that don't ack.
+        """
+        self.stdout.write("")
+        for process, report in sorted(outboxes.items()):
+            self.stdout.write(f"{process}: {report['connections']} connections, {report['queued']} frames queued")
+
+        rows = sorted(
+            (row for report in outboxes.values() for row in report["deepest"]),
+            key=lambda row: row["depth"],
+            reverse=True,
+        )
+
+        if not rows:
+            return
+
+        self.stdout.write(f"{'depth':>6}  {'peak':>6}  {'unacked':>7}  room / channel")
+        for row in rows:
+            unacked = "" if row["unacked"] is None else row["unacked"]
+            self.stdout.write(f"{row['depth']:>6}  {row['peak']:>6}  {unacked:>7}  {row['room']} / {row['channel']}")
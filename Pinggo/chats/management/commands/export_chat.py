@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+import sys
+
+
+class Command(BaseCommand):
+    help = "Stream a chat's full message history to NDJSON or CSV"
+
+    def add_arguments(self, parser):
+        parser.add_argument("chat_type")
+        parser.add_argument("chat_name")
+        parser.add_argument("--format", choices=["ndjson", "csv"], default="ndjson")
+        parser.add_argument("--gzip", action="store_true")
+        parser.add_argument("--output", help="File to write to (default: stdout)")
+
+    def handle(self, *args, **options):
+        from chats.service.chat_service import ChatService
+        from chats.service.export_service import ExportService
+
+        chat = ChatService.load_chat(options["chat_type"], options["chat_name"])
+
+        if not chat:
+            raise CommandError("Chat does not exist")
+
+        chunks = ExportService.export(chat, options["format"], options["gzip"])
+
+        if not options["output"]:
+            out = sys.stdout.buffer if options["gzip"] else sys.stdout
+        elif options["gzip"]:
+            out = open(options["output"], "wb")
+        else:
+            out = open(options["output"], "w", newline="", encoding="utf-8")
+
+        try:
+            for chunk in chunks:
+                out.write(chunk)
+        finally:
+            if options["output"]:
+                out.close()
+
+        if options["output"]:
+            self.stderr.write(self.style.SUCCESS(f"Exported {chat.group_name} to {options['output']}"))
@@ -0,0 +1,278 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from datetime import datetime, timezone as dt_timezone
+from pathlib import Path
+import gzip
+import re
+
+from chats.partition_migration import is_partitioned
+
+
+BOUND_RE = re.compile(r"FROM \((?:MINVALUE|'(?P<start>[^']+)')\) TO \('(?P<end>[^']+)'\)")
+
+
+def month_start(value):
+    return datetime(value.year, value.month, 1, tzinfo=dt_timezone.utc)
+
+
+def add_months(value, months):
+    month = value.month - 1 + months
+    return value.replace(year=value.year + month // 12, month=month % 12 + 1)
+
+
+class Command(BaseCommand):
+    help = "Manage monthly range partitions of the chat messages table"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "action",
+            choices=["convert", "ensure", "archive", "status"],
+            help=(
+                "convert: one-off switch to a partitioned table; "
+                "ensure: create upcoming monthly partitions (run daily); "
+                "archive: export and drop history past CHAT_RETENTION_MONTHS; "
+                "status: list partitions"
+            ),
+        )
+        parser.add_argument("--months-ahead", type=int, default=3)
+        parser.add_argument("--archive-dir", default=settings.CHAT_ARCHIVE_DIR)
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, **options):
+        from chats.models import ChatGroup, GroupMessage
+
+        if connection.vendor != "postgresql":
+            raise CommandError("Partitioning needs PostgreSQL.")
+
+        self.table = GroupMessage._meta.db_table
+        self.group_table = ChatGroup._meta.db_table
+        self.dry_run = options["dry_run"]
+
+        if options["action"] != "convert" and not self.is_partitioned():
+            raise CommandError(f"{self.table} isn't partitioned yet; run 'convert' first.")
+
+        if options["action"] == "convert":
+            self.convert(options["months_ahead"])
+        elif options["action"] == "ensure":
+            self.ensure(options["months_ahead"])
+        elif options["action"] == "archive":
+            self.archive(Path(options["archive_dir"]))
+        else:
+            for name, start, end, rows in self.partitions(with_rows=True):
+                self.stdout.write(f"{name}: {start or '-inf'} .. {end or '+inf'} ({rows} rows)")
+
+    def execute_sql(self, sql, params=None):
+        if self.dry_run:
+            self.stdout.write(sql if params is None else f"{sql}  -- {params}")
+            return
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+
+    def is_partitioned(self):
+        return is_partitioned(connection, self.table)
+
+    def partitions(self, with_rows=False):
+        """
+        (name, start, end, rows) per partition, oldest first. ``start`` is
+        None for the legacy partition, ``end`` None for the default one.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid), c.reltuples::bigint "
+                "FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                "WHERE i.inhparent = %s::regclass",
+                [self.table],
+            )
+            rows = cursor.fetchall()
+
+        result = []
+        for name, bound, estimate in rows:
+            match = BOUND_RE.search(bound)
+            start = end = None
+            if match:
+                start = datetime.fromisoformat(match["start"]) if match["start"] else None
+                end = datetime.fromisoformat(match["end"])
+            result.append((name, start, end, max(estimate, 0) if with_rows else None))
+
+        return sorted(result, key=lambda p: (p[2] is None, p[2] or datetime.max.replace(tzinfo=dt_timezone.utc)))
+
+    def partition_name(self, month):
+        return f"{self.table}_p{month:%Y%m}"
+
+    def convert(self, months_ahead):
+        """
+        Turn the existing table into the first partition of a new table
+        partitioned by created_at, then add the monthly ones. The legacy
+        partition takes everything up to the month after the newest row, so
+        live rows (and any clock-skewed ones) stay in range. Takes an
+        exclusive lock on the table while it runs.
+        """
+        if self.is_partitioned():
+            raise CommandError(f"{self.table} is already partitioned.")
+
+        table, legacy = self.table, f"{self.table}_legacy"
+
+        with transaction.atomic():
+            self.execute_sql(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE")
+
+            with connection.cursor() as cursor:
+                cursor.execute(f"SELECT COALESCE(MAX(id), 0), MAX(created_at) FROM {table}")
+                last_id, newest = cursor.fetchone()
+
+            cutover = add_months(month_start(max(filter(None, [newest, timezone.now()]))), 1)
+
+            self.execute_sql(f"ALTER TABLE {table} RENAME TO {legacy}")
+            self.execute_sql(f"ALTER TABLE {legacy} RENAME CONSTRAINT {table}_pkey TO {legacy}_pkey")
+            # Partitions can't carry their own identity column; ids come from
+            # a plain sequence owned by the new table instead (which keeps
+            # pg_get_serial_sequence working for the write-behind path).
+            self.execute_sql(f"ALTER TABLE {legacy} ALTER COLUMN id DROP IDENTITY IF EXISTS")
+            self.execute_sql(
+                f"CREATE TABLE {table} (LIKE {legacy} INCLUDING DEFAULTS INCLUDING GENERATED INCLUDING STORAGE) "
+                f"PARTITION BY RANGE (created_at)"
+            )
+            self.execute_sql(f"CREATE SEQUENCE {table}_id_seq START {last_id + 1} OWNED BY {table}.id")
+            self.execute_sql(f"ALTER TABLE {table} ALTER COLUMN id SET DEFAULT nextval('{table}_id_seq')")
+
+            # The partition key has to be part of every unique constraint, so
+            # (group, seq) is only unique per partition; seqs are allocated
+            # under the ChatGroup row lock, which is what keeps them unique.
+            self.execute_sql(f"ALTER TABLE {table} ADD PRIMARY KEY (id, created_at)")
+            self.execute_sql(
+                f"ALTER TABLE {table} ADD FOREIGN KEY (group_id) REFERENCES {self.group_table} (id) "
+                f"DEFERRABLE INITIALLY DEFERRED"
+            )
+            self.execute_sql(
+                f"ALTER TABLE {table} ADD FOREIGN KEY (author_id) REFERENCES auth_user (id) "
+                f"DEFERRABLE INITIALLY DEFERRED"
+            )
+            self.execute_sql(f"CREATE INDEX {table}_group_created_part ON {table} (group_id, created_at, id)")
+            self.execute_sql(f"CREATE INDEX {table}_group_seq_part ON {table} (group_id, seq)")
+            self.execute_sql(f"CREATE INDEX {table}_search_part ON {table} USING gin (group_id, search_vector)")
+
+            # A validated CHECK lets ATTACH skip its own full scan.
+            self.execute_sql(
+                f"ALTER TABLE {legacy} ADD CONSTRAINT {legacy}_range "
+                f"CHECK (created_at IS NOT NULL AND created_at < %s) NOT VALID",
+                [cutover],
+            )
+            self.execute_sql(f"ALTER TABLE {legacy} VALIDATE CONSTRAINT {legacy}_range")
+
+            # The partition's primary key has to match the parent's. ATTACH
+            # adopts a matching constraint (not a bare unique index) instead
+            # of building another one.
+            self.execute_sql(f"ALTER TABLE {legacy} DROP CONSTRAINT {legacy}_pkey")
+            self.execute_sql(f"ALTER TABLE {legacy} ADD CONSTRAINT {legacy}_pkey PRIMARY KEY (id, created_at)")
+            self.execute_sql(
+                f"ALTER TABLE {table} ATTACH PARTITION {legacy} FOR VALUES FROM (MINVALUE) TO (%s)",
+                [cutover],
+            )
+            self.execute_sql(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT")
+
+            self.create_partitions(cutover, months_ahead)
+
+        self.stdout.write(self.style.SUCCESS(f"Partitioned {table}; history before {cutover:%Y-%m} is in {legacy}"))
+
+    def ensure(self, months_ahead):
+        with transaction.atomic():
+            created = self.create_partitions(month_start(timezone.now()), months_ahead)
+
+        self.stdout.write(self.style.SUCCESS(f"Created {created} partition(s)"))
+
+    def create_partitions(self, first_month, months_ahead):
+        # Months up to the end of the newest range (the legacy partition
+        # right after convert) are already covered.
+        covered = max((end for _, _, end, _ in self.partitions() if end), default=None)
+        created = 0
+
+        for offset in range(months_ahead + 1):
+            month = add_months(first_month, offset)
+            name = self.partition_name(month)
+
+            if covered is not None and month < covered:
+                continue
+
+            # Rows that landed in the default partition (because this month
+            # wasn't created in time) would block the new range; fail loudly.
+            self.execute_sql(
+                f"CREATE TABLE {name} PARTITION OF {self.table} FOR VALUES FROM (%s) TO (%s)",
+                [month, add_months(month, 1)],
+            )
+            created += 1
+
+        return created
+
+    def archive(self, archive_dir):
+        """
+        Apply CHAT_RETENTION_MONTHS. A partition past the retention of every
+        chat type is exported whole and detached; otherwise only the expired
+        rows of each chat type are exported and deleted (which is also how
+        the legacy partition from ``convert`` is trimmed month by month).
+        """
+        retention = settings.CHAT_RETENTION_MONTHS
+        now = month_start(timezone.now())
+        cutoffs = {
+            chat_type: add_months(now, -months)
+            for chat_type, months in retention.items()
+            if months
+        }
+
+        if not cutoffs:
+            self.stdout.write("No retention configured.")
+            return
+
+        archive_dir.mkdir(parents=True, exist_ok=True)
+        keeps_forever = len(cutoffs) < len(retention)
+
+        for name, start, end, _ in self.partitions():
+            if end is None:
+                continue
+
+            if not keeps_forever and all(end <= cutoff for cutoff in cutoffs.values()):
+                self.export(archive_dir / f"{name}.csv.gz", f"SELECT * FROM {name}")
+                with transaction.atomic():
+                    self.execute_sql(f"ALTER TABLE {self.table} DETACH PARTITION {name}")
+                    self.execute_sql(f"DROP TABLE {name}")
+                self.stdout.write(self.style.SUCCESS(f"Archived and dropped {name}"))
+                continue
+
+            for chat_type, cutoff in cutoffs.items():
+                if start is not None and start >= cutoff:
+                    continue
+
+                rows = (
+                    f"FROM {name} m JOIN {self.group_table} g ON g.id = m.group_id "
+                    f"WHERE g.chat_type = %s AND m.created_at < %s"
+                )
+                params = [chat_type, cutoff]
+
+                with connection.cursor() as cursor:
+                    cursor.execute(f"SELECT EXISTS (SELECT 1 {rows})", params)
+                    if not cursor.fetchone()[0]:
+                        continue
+
+                with transaction.atomic():
+                    self.export(archive_dir / f"{name}.{chat_type}.{cutoff:%Y%m}.csv.gz", f"SELECT m.* {rows}", params)
+                    self.execute_sql(
+                        f"DELETE FROM {name} m USING {self.group_table} g "
+                        f"WHERE g.id = m.group_id AND g.chat_type = %s AND m.created_at < %s",
+                        params,
+                    )
+                self.stdout.write(self.style.SUCCESS(f"Archived {chat_type} messages before {cutoff:%Y-%m} from {name}"))
+
+    def export(self, path, query, params=None):
+        """
+        Stream ``query`` to a gzipped CSV with COPY, without loading the
+        partition into memory.
+        """
+        if self.dry_run:
+            self.stdout.write(f"COPY ({query}) -> {path}  -- {params}")
+            return
+
+        with connection.cursor() as cursor, gzip.open(path, "wb") as out:
+            with cursor.cursor.copy(f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER)", params) as copy:
+                for data in copy:
+                    out.write(data)
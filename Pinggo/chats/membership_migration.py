@@ -0,0 +1,106 @@
+"""
+Migration operations for databases created before ChatGroup.members went
+through ChatMembership.
+
+Django can't add ``through=`` to an existing ManyToManyField, and the
+migration makemigrations generates for it tries to create
+chats_chatgroup_members, which already exists. These operations adopt that
+table instead: the model and the field change are recorded in migration
+state only, then last_read_seq and the index are added, and the existing
+(chatgroup_id, user_id) unique constraint is renamed rather than built
+again.
+
+On an existing deployment, before running makemigrations for the rest of
+the schema::
+
+    python manage.py makemigrations chats --empty --name chat_membership
+
+then replace the ``operations`` list in the generated file with::
+
+    from chats.membership_migration import OPERATIONS
+
+    operations = OPERATIONS
+
+and run ``makemigrations`` and ``migrate`` as usual. New databases don't
+need any of this.
+"""
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+TABLE = "chats_chatgroup_members"
+
+RENAME_UNIQUE_SQL = f"""
+DO $$
+DECLARE
+    name text;
+BEGIN
+    SELECT conname INTO name FROM pg_constraint
+    WHERE conrelid = '{TABLE}'::regclass AND contype = 'u';
+
+    IF name IS NOT NULL AND name <> 'chat_membership_uniq' THEN
+        EXECUTE format('ALTER TABLE {TABLE} RENAME CONSTRAINT %I TO chat_membership_uniq', name);
+    END IF;
+END $$;
+"""
+
+OPERATIONS = [
+    migrations.SeparateDatabaseAndState(
+        state_operations=[
+            migrations.CreateModel(
+                name="ChatMembership",
+                fields=[
+                    ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                    (
+                        "chatgroup",
+                        models.ForeignKey(
+                            on_delete=models.CASCADE,
+                            related_name="memberships",
+                            to="chats.chatgroup",
+                        ),
+                    ),
+                    (
+                        "user",
+                        models.ForeignKey(
+                            on_delete=models.CASCADE,
+                            related_name="chat_memberships",
+                            to=settings.AUTH_USER_MODEL,
+                        ),
+                    ),
+                ],
+                options={"db_table": TABLE},
+            ),
+            migrations.AlterField(
+                model_name="chatgroup",
+                name="members",
+                field=models.ManyToManyField(
+                    blank=True,
+                    related_name="chat_groups",
+                    through="chats.ChatMembership",
+                    to=settings.AUTH_USER_MODEL,
+                ),
+            ),
+        ],
+    ),
+    migrations.AddField(
+        model_name="chatmembership",
+        name="last_read_seq",
+        field=models.PositiveBigIntegerField(default=0),
+    ),
+    migrations.SeparateDatabaseAndState(
+        database_operations=[
+            migrations.RunSQL(RENAME_UNIQUE_SQL, migrations.RunSQL.noop),
+        ],
+        state_operations=[
+            migrations.AddConstraint(
+                model_name="chatmembership",
+                constraint=models.UniqueConstraint(fields=("chatgroup", "user"), name="chat_membership_uniq"),
+            ),
+        ],
+    ),
+    migrations.AddIndex(
+        model_name="chatmembership",
+        index=models.Index(fields=["user", "chatgroup"], name="chat_membership_user_idx"),
+    ),
+]
@@ -1,8 +1,11 @@
-from allauth.account.models import EmailAddress
+from channels.middleware import BaseMiddleware
+from channels.security.websocket import WebsocketDenier
 from django.contrib import messages
 from django.shortcuts import redirect
 from django.urls import reverse
 
+from users.services.email_service import EmailService
+
 
 EMAIL_VERIFIED_ROUTES = (
     "/chat/",
@@ -17,13 +20,29 @@ class EmailVerifiedMiddleware:
             request.path.startswith(EMAIL_VERIFIED_ROUTES) and
             request.user.is_authenticated
         ):
-            is_verified = EmailAddress.objects.filter(
-                user=request.user,
-                verified=True,
-            ).exists()
+            is_verified = EmailService.is_email_verified(request.user)
 
             if not is_verified:
                 messages.warning(request, "Please verify your email first.")
                 return redirect(reverse("profile_settings"))
 
         return self.get_response(request)
+
+
+class EmailVerifiedWebsocketMiddleware(BaseMiddleware):
+    """
+    Same check for the WebSocket path. Must sit inside AuthMiddlewareStack so
+    scope["user"] is resolved; the verified flag comes from the cache.
+    """
+
+    async def __call__(self, scope, receive, send):
+        user = scope.get("user")
+
+        if (
+            user is not None and
+            user.is_authenticated and
+            not await EmailService.async_is_email_verified(user)
+        ):
+            return await WebsocketDenier.as_asgi()(scope, receive, send)
+
+        return await super().__call__(scope, receive, send)
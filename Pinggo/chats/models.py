@@ -1,3 +1,5 @@
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
 from django.core.exceptions import ValidationError
 from django.templatetags.static import static
 from django.contrib.auth.models import User
@@ -16,6 +18,10 @@ class ChatGroup(models.Model):
     chat_type = models.CharField(max_length=10, choices=CHAT_TYPES, default="global")
     description = models.TextField(max_length=350, blank=True)
     image_url = models.URLField(blank=True)
+    display_title = models.CharField(max_length=255, blank=True, editable=False)
+    last_seq = models.PositiveBigIntegerField(default=0, editable=False)
+    last_message_at = models.DateTimeField(null=True, blank=True, editable=False, db_index=True)
+    last_message_preview = models.CharField(max_length=255, blank=True, editable=False)
 
     creator = models.ForeignKey(
         User,
@@ -27,6 +33,7 @@ class ChatGroup(models.Model):
 
     members = models.ManyToManyField(
         User,
+        through="ChatMembership",
         related_name="chat_groups",
         blank=True
     )
@@ -45,6 +52,7 @@ class ChatGroup(models.Model):
             raise ValidationError("Global chat should not have members.")
 
     def save(self, *args, **kwargs):
+        self.display_title = self.build_display_name()
         super().save(*args, **kwargs)
 
         if self.chat_type in ["group", "private"]:
@@ -83,12 +91,20 @@ class ChatGroup(models.Model):
 
         return name.replace("_", " ").replace("-", " ").title()
 
+    def build_display_name(self):
+        name = self.group_name
+
+        if self.creator_id:
+            prefix = f"{self.creator.username}-group"
+            if name.startswith(prefix):
+                name = name[len(prefix):]
+
+        return name.replace('_', ' ').replace('-', ' ').strip().title()
+
     @property
     def display_name(self):
-        prefix = f"{self.creator.username}-group"
-        if self.group_name.startswith(prefix):
-            return self.group_name[len(prefix):].replace('_', ' ').replace('-', ' ').title()
-        return self.group_name.replace('_', ' ').replace('-', ' ').title()
+        # Stored at save time so sidebars don't need the creator per row.
+        return self.display_title or self.build_display_name()
 
     @property
     def pic(self):
@@ -97,6 +113,41 @@ class ChatGroup(models.Model):
         return static("images/group.svg")
 
 
+class ChatMembership(models.Model):
+    """
+    Through model for ChatGroup.members. It keeps the default M2M table, so
+    members.add()/remove()/set() work as before; ``last_read_seq`` is what
+    unread counts are computed from (ChatGroup.last_seq - last_read_seq).
+    New memberships start at the chat's last_seq (see chats.signals).
+    Existing databases migrate with chats.membership_migration.
+    """
+
+    chatgroup = models.ForeignKey(ChatGroup, on_delete=models.CASCADE, related_name="memberships")
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="chat_memberships")
+    last_read_seq = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user} in {self.chatgroup}"
+
+    @property
+    def unread_count(self):
+        return max(self.chatgroup.last_seq - self.last_read_seq, 0)
+
+    class Meta:
+        db_table = "chats_chatgroup_members"
+        constraints = [
+            models.UniqueConstraint(fields=["chatgroup", "user"], name="chat_membership_uniq"),
+        ]
+        indexes = [
+            models.Index(fields=["user", "chatgroup"], name="chat_membership_user_idx"),
+        ]
+
+
+PREVIEW_LENGTH = 100
+
+SEARCH_CONFIG = "english"
+
+
 class GroupMessage(models.Model):
     group = models.ForeignKey(ChatGroup, related_name='chat_messages', db_index=True, on_delete=models.CASCADE)
     author = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -112,8 +163,16 @@ class GroupMessage(models.Model):
                                  ],
                                  blank=True)
     file_name = models.CharField(max_length=255, blank=True)
-    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
-
+    created_at = models.DateTimeField(default=timezone.now, editable=False, db_index=True)
+    seq = models.PositiveBigIntegerField(null=True, blank=True, editable=False)
+
+    # Stored generated column: Postgres keeps it in sync on every insert and
+    # update, so there is no trigger or backfill job to maintain.
+    search_vector = models.GeneratedField(
+        expression=SearchVector("message", config=SEARCH_CONFIG),
+        output_field=SearchVectorField(),
+        db_persist=True,
+    )
 
     @property
     def is_image(self):
@@ -145,6 +204,10 @@ class GroupMessage(models.Model):
             return self.file_name
         return ""
 
+    @property
+    def preview(self):
+        return (self.message or self.filename)[:PREVIEW_LENGTH]
+
     def __str__(self):
         if self.message:
             return f'{self.author}: {self.message}'
@@ -156,9 +219,31 @@ class GroupMessage(models.Model):
         if not self.group.members.filter(id=self.author_id).exists():
             raise ValidationError("Author is not a member of this group.")
 
-    def save(self, *args, **kwargs):
-        self.full_clean()
+    def save(self, *args, validate=True, **kwargs):
+        # validate=False is for callers that already authorized the author
+        # (e.g. the consumer at connect time) and skips the membership query.
+        if validate:
+            self.full_clean()
         super().save(*args, **kwargs)
 
+    # The table can be range-partitioned by month on created_at with
+    # "manage.py partition_messages convert". History queries bound
+    # created_at from below (see chats.utility.history_window) so Postgres
+    # prunes the older partitions; the default partition, empty as long as
+    # "partition_messages ensure" runs, is always scanned.
+    #
+    # A partitioned table's primary key is (id, created_at) and it has no
+    # (group, seq) constraint, whatever is declared here; migrations touching
+    # either, or the indexes below, go through
+    # chats.partition_migration.UnlessPartitioned.
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=["group", "created_at", "id"], name="chat_msg_group_created_idx"),
+            # Leading group column (via btree_gin) lets a search probe only
+            # the rooms the user can see instead of filtering every match.
+            GinIndex(fields=["group", "search_vector"], name="chat_msg_search_idx"),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=["group", "seq"], name="chat_msg_group_seq_uniq"),
+        ]
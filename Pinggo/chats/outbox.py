@@ -0,0 +1,174 @@
+from collections import deque
+from django.conf import settings
+import asyncio
+
+from Pinggo.metrics import metrics
+
+
+MESSAGE = "message"
+PRESENCE = "presence"
+TYPING = "typing"
+CLOSE = "close"
+
+
+class Outbox:
+    """
+    Per-connection outbound queue. Handlers enqueue and return right away, so
+    one slow reader never holds up the consumer's channel-layer receive loop;
+    a writer task drains the queue into the socket.
+
+    Pending presence frames are always coalesced into one (only the latest
+    count matters). Above ``high_water`` typing frames are dropped, and a
+    connection that reaches ``limit`` is closed with ``overflow_code`` so the
+    client resyncs instead of silently missing messages.
+
+    The server can't see a slow reader on its own: under Daphne ``send``
+    returns as soon as the frame is buffered. Clients therefore ack what
+    they have received (``ack``), and once a client has acked, at most
+    ``window`` frames are sent ahead of its acks. A reader that falls behind
+    leaves frames queued here, where the limits above apply. Clients that
+    never ack are sent frames as fast as they are queued.
+    """
+
+    # A plain set, not a WeakSet: the metrics thread copies it, which is
+    # atomic for a set. Connections leave it in ``stop``.
+    live = set()
+
+    def __init__(self, consumer, room, high_water, limit, overflow_code, window):
+        self.consumer = consumer
+        self.room = room
+        self.high_water = high_water
+        self.limit = limit
+        self.overflow_code = overflow_code
+        self.window = window
+        self.frames = deque()
+        self.presence = None
+        self.peak = 0
+        self.sent = 0
+        self.acked = None
+        self.closing = False
+        self.ready = asyncio.Event()
+        self.window_open = asyncio.Event()
+        self.task = asyncio.create_task(self.run())
+        Outbox.live.add(self)
+        metrics.start()
+
+    def __len__(self):
+        return len(self.frames)
+
+    def put(self, kind, frame):
+        if self.closing:
+            return
+
+        if kind == PRESENCE and self.presence is not None:
+            self.presence[1] = frame
+            metrics.incr("outbox.coalesced.presence")
+            return
+
+        depth = len(self.frames)
+
+        if kind == TYPING and depth >= self.high_water:
+            metrics.incr("outbox.dropped.typing")
+            return
+
+        if depth >= self.limit:
+            metrics.incr("outbox.overflow")
+            self.frames.clear()
+            self.presence = None
+            self.close(self.overflow_code)
+            return
+
+        entry = [kind, frame]
+        if kind == PRESENCE:
+            self.presence = entry
+
+        self.frames.append(entry)
+        self.peak = max(self.peak, depth + 1)
+        self.ready.set()
+
+    def ack(self, count):
+        """
+        The client has received ``count`` frames on this connection. Acks
+        are cumulative, so a lost one is covered by the next.
+        """
+        self.acked = max(self.acked or 0, min(count, self.sent))
+        self.window_open.set()
+
+    def unacked(self):
+        if self.acked is None:
+            return None
+        return self.sent - self.acked
+
+    def blocked(self):
+        # Once closing, the rest goes out regardless of the window: a close
+        # is what a reader that stopped acking gets.
+        unacked = self.unacked()
+        return not self.closing and unacked is not None and unacked >= self.window
+
+    def close(self, code=None):
+        """
+        Close after everything already queued has gone out.
+        """
+        if self.closing:
+            return
+
+        self.closing = True
+        self.frames.append([CLOSE, {"code": code}])
+        self.ready.set()
+        self.window_open.set()
+
+    async def run(self):
+        while True:
+            while not self.frames:
+                self.ready.clear()
+                await self.ready.wait()
+
+            while self.blocked():
+                metrics.incr("outbox.window_full")
+                self.window_open.clear()
+                await self.window_open.wait()
+
+            entry = self.frames.popleft()
+            kind, frame = entry
+
+            if entry is self.presence:
+                self.presence = None
+
+            if kind == CLOSE:
+                await self.consumer.close(**frame)
+                return
+
+            await self.consumer.send(**frame)
+            self.sent += 1
+
+    def stop(self):
+        self.task.cancel()
+        Outbox.live.discard(self)
+
+    @staticmethod
+    def report():
+        """
+        Queue depth of every live connection in this process, deepest first;
+        the rooms at the top are the ones with slow readers.
+        """
+        rows = [
+            {
+                "room": outbox.room,
+                "channel": outbox.consumer.channel_name,
+                "depth": len(outbox),
+                "peak": outbox.peak,
+                "unacked": outbox.unacked(),
+            }
+            for outbox in list(Outbox.live)
+        ]
+        return sorted(rows, key=lambda row: row["depth"], reverse=True)
+
+
+@metrics.reporter("outbox")
+def report_outboxes():
+    rows = Outbox.report()
+    return {
+        "connections": len(rows),
+        "queued": sum(row["depth"] for row in rows),
+        "deepest": rows[:settings.METRICS_REPORT_ROWS],
+    }
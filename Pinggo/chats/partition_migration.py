@@ -0,0 +1,76 @@
+"""
+Migrations on a database whose messages table was partitioned with
+"manage.py partition_messages convert".
+
+After ``convert`` the schema of chats_groupmessage no longer matches what
+GroupMessage declares, and Django's migration state doesn't know:
+
+- the primary key is (id, created_at), since every unique constraint on a
+  partitioned table must include the partition key; ``id`` still comes from
+  chats_groupmessage_id_seq and stays unique in practice;
+- the (group, seq) constraint chat_msg_group_seq_uniq is left on the legacy
+  partition only; newer seqs are kept unique by being allocated under the
+  ChatGroup row lock, and the chats_groupmessage_group_seq_part index serves
+  the lookups;
+- likewise the model's named indexes (chat_msg_group_created_idx,
+  chat_msg_search_idx) only exist on the legacy partition; the parent has
+  the ``*_part`` equivalents.
+
+Those are the supported differences. A migration that touches the primary
+key, the (group, seq) constraint or the message indexes would fail there, so
+wrap its operations in UnlessPartitioned: they are recorded in migration
+state everywhere but only run against a table that isn't partitioned::
+
+    from chats.partition_migration import UnlessPartitioned
+
+    operations = [
+        UnlessPartitioned([
+            migrations.RemoveConstraint(model_name="groupmessage", name="chat_msg_group_seq_uniq"),
+        ]),
+    ]
+
+On a partitioned database, make the matching change on the parent table by
+hand (or in partition_messages) in the same release.
+"""
+
+from django.db import migrations
+
+
+TABLE = "chats_groupmessage"
+
+
+def is_partitioned(connection, table=TABLE):
+    if connection.vendor != "postgresql":
+        return False
+
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE relname = %s", [table])
+        row = cursor.fetchone()
+    return row is not None and row[0] == "p"
+
+
+class UnlessPartitioned(migrations.SeparateDatabaseAndState):
+    """
+    ``operations`` always change the migration state, and the database only
+    while the messages table isn't partitioned.
+    """
+
+    serialization_expand_args = ["operations"]
+
+    def __init__(self, operations):
+        self.operations = operations
+        super().__init__(database_operations=operations, state_operations=operations)
+
+    def deconstruct(self):
+        return (self.__class__.__qualname__, [self.operations], {})
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if not is_partitioned(schema_editor.connection):
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if not is_partitioned(schema_editor.connection):
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+
+    def describe(self):
+        return "Unless messages are partitioned: " + "; ".join(op.describe() for op in self.operations)
@@ -19,24 +19,173 @@ For Testing only  (Used Initially when redis cache was not initialized)
 #         cls.online_users_id.discard(id)
 
 
-from django_redis import get_redis_connection
+import time
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.template.loader import render_to_string
+
+from .debounce import RoomDebouncer
+from .redis_client import get_redis, get_async_redis
+from .utility import room_group_name
+
+
+# Presence is stored per connection so a crashed worker or a second tab can't
+# corrupt the count:
+#   presence:{room}          ZSET  "<user_id>:<channel_name>" -> last heartbeat
+#   presence:{room}:users    HASH  user_id -> live connection count
+#   presence:{room}:reaper   lock so only one consumer reaps a room per interval
+# The online count is HLEN of the users hash, i.e. distinct users.
+
+TOUCH_SCRIPT = """
+if redis.call('ZADD', KEYS[1], ARGV[3], ARGV[1]) == 1 then
+    redis.call('HINCRBY', KEYS[2], ARGV[2], 1)
+end
+
+if redis.call('SET', KEYS[3], 1, 'NX', 'PX', ARGV[6]) then
+    local dead = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[5], 'LIMIT', 0, ARGV[7])
+    for _, member in ipairs(dead) do
+        redis.call('ZREM', KEYS[1], member)
+        local user_id = string.match(member, '^([^:]+):')
+        if redis.call('HINCRBY', KEYS[2], user_id, -1) <= 0 then
+            redis.call('HDEL', KEYS[2], user_id)
+        end
+    end
+end
+
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+redis.call('EXPIRE', KEYS[2], ARGV[4])
+return redis.call('HLEN', KEYS[2])
+"""
+
+REMOVE_SCRIPT = """
+if redis.call('ZREM', KEYS[1], ARGV[1]) == 1 then
+    if redis.call('HINCRBY', KEYS[2], ARGV[2], -1) <= 0 then
+        redis.call('HDEL', KEYS[2], ARGV[2])
+    end
+end
+return redis.call('HLEN', KEYS[2])
+"""
+
+
+def presence_key(chat_type, chat_name):
+    # Hash tag keeps a room's keys on one slot for clustered Redis.
+    return f"presence:{{{chat_type}:{chat_name}}}"
+
+
+def _touch_args(chat_type, chat_name, user_id, channel_name):
+    key = presence_key(chat_type, chat_name)
+    now = time.time()
+
+    keys = [key, f"{key}:users", f"{key}:reaper"]
+    args = [
+        f"{user_id}:{channel_name}",
+        user_id,
+        now,
+        settings.PRESENCE_TTL,
+        now - settings.PRESENCE_TTL,
+        settings.PRESENCE_HEARTBEAT_INTERVAL * 1000,
+        settings.PRESENCE_REAP_BATCH,
+    ]
+    return keys, args
+
+
+def _remove_args(chat_type, chat_name, user_id, channel_name):
+    key = presence_key(chat_type, chat_name)
+    return [key, f"{key}:users"], [f"{user_id}:{channel_name}", user_id]
+
+
+class AsyncPresence:
+    """
+    Presence for consumers. Every call is a single script round-trip on the
+    asyncio client, so the event loop is never blocked on Redis.
+
+    ``add`` doubles as the heartbeat: it refreshes the connection's score and
+    the room TTL, and reaps a bounded batch of expired connections if no
+    other consumer has done so in the last heartbeat interval.
+    """
+
+    _touch = None
+    _remove = None
+
+    @classmethod
+    def _scripts(cls):
+        if cls._touch is None:
+            redis = get_async_redis()
+            cls._touch = redis.register_script(TOUCH_SCRIPT)
+            cls._remove = redis.register_script(REMOVE_SCRIPT)
+        return cls._touch, cls._remove
+
+    @classmethod
+    async def add(cls, chat_type, chat_name, user_id, channel_name):
+        touch, _ = cls._scripts()
+        keys, args = _touch_args(chat_type, chat_name, user_id, channel_name)
+        return await touch(keys=keys, args=args)
+
+    heartbeat = add
+
+    @classmethod
+    async def remove(cls, chat_type, chat_name, user_id, channel_name):
+        _, remove = cls._scripts()
+        keys, args = _remove_args(chat_type, chat_name, user_id, channel_name)
+        return await remove(keys=keys, args=args)
+
+    @staticmethod
+    async def count(chat_type, chat_name):
+        return await get_async_redis().hlen(f"{presence_key(chat_type, chat_name)}:users")
 
 
 class Presence:
-    redis = get_redis_connection("default")
+    """
+    Sync facade for views and management commands.
+    """
 
     @staticmethod
     def key(chat_type, chat_name):
-        return f"presence:{chat_type}:{chat_name}"
+        return presence_key(chat_type, chat_name)
 
     @classmethod
-    def add(cls, chat_type, chat_name, user_id):
-        cls.redis.sadd(cls.key(chat_type, chat_name), user_id)
+    def add(cls, chat_type, chat_name, user_id, channel_name):
+        keys, args = _touch_args(chat_type, chat_name, user_id, channel_name)
+        return get_redis().eval(TOUCH_SCRIPT, len(keys), *keys, *args)
 
     @classmethod
-    def remove(cls, chat_type, chat_name, user_id):
-        cls.redis.srem(cls.key(chat_type, chat_name), user_id)
+    def remove(cls, chat_type, chat_name, user_id, channel_name):
+        keys, args = _remove_args(chat_type, chat_name, user_id, channel_name)
+        return get_redis().eval(REMOVE_SCRIPT, len(keys), *keys, *args)
 
     @classmethod
     def count(cls, chat_type, chat_name):
-        return cls.redis.scard(cls.key(chat_type, chat_name))
\ No newline at end of file
+        return get_redis().hlen(f"{cls.key(chat_type, chat_name)}:users")
+
+
+online_count_debouncer = RoomDebouncer("online-count", settings.PRESENCE_BROADCAST_INTERVAL)
+
+
+def render_online_count(count):
+    return render_to_string("chats/partials/online_count.html", {"count": count})
+
+
+async def broadcast_online_count(chat_type, chat_name):
+    """
+    Send the room its latest online count, rendered once. Callers go through
+    ``schedule_online_count`` so a reconnect storm collapses into one
+    broadcast per room per PRESENCE_BROADCAST_INTERVAL.
+    """
+    count = await AsyncPresence.count(chat_type, chat_name) - 1
+
+    await get_channel_layer().group_send(
+        room_group_name(chat_type, chat_name),
+        {
+            "type": "online_count_handler",
+            "count": count,
+            "html": render_online_count(count),
+        }
+    )
+
+
+async def schedule_online_count(chat_type, chat_name):
+    await online_count_debouncer.schedule(
+        room_group_name(chat_type, chat_name),
+        lambda: broadcast_online_count(chat_type, chat_name),
+    )
@@ -0,0 +1,47 @@
+from urllib.parse import parse_qs
+import json
+
+import msgpack
+
+
+HTML = "html"
+JSON = "json"
+MSGPACK = "msgpack"
+
+SUBPROTOCOLS = {
+    "pinggo.json": JSON,
+    "pinggo.msgpack": MSGPACK,
+}
+
+
+def negotiate(scope):
+    """
+    Pick the wire protocol for a socket. Structured clients either offer a
+    ``pinggo.json``/``pinggo.msgpack`` subprotocol or pass ``?protocol=``;
+    anything else gets the default HTMX HTML frames.
+
+    Returns ``(protocol, subprotocol to accept with)``.
+    """
+    for subprotocol in scope.get("subprotocols", []):
+        if subprotocol in SUBPROTOCOLS:
+            return SUBPROTOCOLS[subprotocol], subprotocol
+
+    query = parse_qs(scope.get("query_string", b"").decode())
+    protocol = query.get("protocol", [HTML])[0]
+
+    if protocol in (JSON, MSGPACK):
+        return protocol, None
+
+    return HTML, None
+
+
+def encode(protocol, payload):
+    if protocol == MSGPACK:
+        return {"bytes_data": msgpack.packb(payload)}
+    return {"text_data": json.dumps(payload, separators=(",", ":"))}
+
+
+def decode(text_data=None, bytes_data=None):
+    if bytes_data is not None:
+        return msgpack.unpackb(bytes_data)
+    return json.loads(text_data)
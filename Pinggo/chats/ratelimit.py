@@ -0,0 +1,198 @@
+from django.conf import settings
+import time
+
+from Pinggo.metrics import metrics
+from .redis_client import get_async_redis
+
+
+# Token bucket kept in Redis for the shared mode. Instead of one token per
+# call it hands out up to ARGV[4] tokens at once, which the node then spends
+# locally; ARGV[5] unspent tokens of the node's previous lease are put back
+# first. Returns the number of tokens granted (0 when empty).
+LEASE_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local want = tonumber(ARGV[4])
+local returned = tonumber(ARGV[5])
+
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate + returned)
+
+local granted = math.min(want, math.floor(tokens))
+tokens = tokens - granted
+
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return granted
+"""
+
+
+class TokenBucket:
+    """
+    Plain in-process token bucket: ``rate`` tokens per second, holding at
+    most ``burst``.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self):
+        self.refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def retry_after(self):
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    def is_idle(self):
+        self.refill()
+        return self.tokens >= self.burst
+
+    def refund(self):
+        """
+        Give back the token just taken, for a message that wasn't sent.
+        """
+        self.tokens = min(self.burst, self.tokens + 1)
+
+
+class LeasedBucket(TokenBucket):
+    """
+    Bucket whose tokens come from the shared Redis bucket in leases, so every
+    node draws from the same budget but only every ``lease``-th message costs
+    a Redis round-trip.
+
+    Leased tokens expire after ``lease / rate`` seconds, the time the shared
+    bucket takes to earn them back: a node can't hoard a lease and spend it
+    in a later burst on top of what the other nodes were granted since.
+    Unspent tokens of an expired lease go back to Redis with the next lease
+    request, so a node sending now and then is only charged for what it
+    sends.
+    """
+
+    def __init__(self, key, rate, burst, lease):
+        super().__init__(rate, burst)
+        self.key = key
+        self.lease = lease
+        self.tokens = 0
+        self.expires = 0.0
+
+    def refill(self):
+        # Tokens are only ever granted by Redis.
+        self.updated = time.monotonic()
+
+    def expired(self):
+        return time.monotonic() >= self.expires
+
+    def is_idle(self):
+        # Pruning drops the tokens of an expired lease instead of returning
+        # them; the shared bucket has earned them back by then anyway.
+        return self.tokens < 1 or self.expired()
+
+    async def acquire(self):
+        if self.tokens < 1 or self.expired():
+            returned, self.tokens = int(self.tokens), 0
+            if returned:
+                metrics.incr("ratelimit.lease_returned", returned)
+
+            granted = await RateLimiter.lease(self.key, self.rate, self.burst, self.lease, returned)
+            if granted:
+                self.tokens = granted
+                self.expires = time.monotonic() + self.lease / self.rate
+        return self.take()
+
+
+class RateLimiter:
+    """
+    Per-user and per-room flood protection for chat sends.
+
+    By default each process enforces the limits on its own. With
+    CHAT_RATE_LIMIT_SHARED the budget lives in Redis and is leased to the
+    nodes in small batches.
+    """
+
+    buckets = {}
+    lease_script = None
+
+    MAX_BUCKETS = 10_000
+
+    @staticmethod
+    def bucket(key, rate, burst):
+        bucket = RateLimiter.buckets.get(key)
+
+        if bucket is None:
+            if len(RateLimiter.buckets) >= RateLimiter.MAX_BUCKETS:
+                RateLimiter.prune()
+
+            if settings.CHAT_RATE_LIMIT_SHARED:
+                bucket = LeasedBucket(f"ratelimit:{key}", rate, burst, settings.CHAT_RATE_LIMIT_LEASE)
+            else:
+                bucket = TokenBucket(rate, burst)
+
+            RateLimiter.buckets[key] = bucket
+
+        return bucket
+
+    @staticmethod
+    def prune():
+        # Idle buckets behave exactly like fresh ones, so they can go.
+        for key, bucket in list(RateLimiter.buckets.items()):
+            if bucket.is_idle():
+                del RateLimiter.buckets[key]
+
+    @staticmethod
+    async def lease(key, rate, burst, count, returned=0):
+        if RateLimiter.lease_script is None:
+            RateLimiter.lease_script = get_async_redis().register_script(LEASE_SCRIPT)
+
+        granted = await RateLimiter.lease_script(keys=[key], args=[rate, burst, time.time(), count, returned])
+        metrics.incr("ratelimit.leases")
+        return int(granted)
+
+    @staticmethod
+    async def take(bucket):
+        if isinstance(bucket, LeasedBucket):
+            return await bucket.acquire()
+        return bucket.take()
+
+    @staticmethod
+    async def check(user_id, room):
+        """
+        Spend one token from the user's and the room's bucket. Returns None
+        when the message may go through, else the seconds to wait. A
+        message the room rejects costs the user nothing.
+        """
+        if not settings.CHAT_RATE_LIMIT_ENABLED:
+            return None
+
+        user_bucket = RateLimiter.bucket(
+            f"user:{user_id}", settings.CHAT_RATE_LIMIT_USER_RATE, settings.CHAT_RATE_LIMIT_USER_BURST
+        )
+        room_bucket = RateLimiter.bucket(
+            f"room:{room}", settings.CHAT_RATE_LIMIT_ROOM_RATE, settings.CHAT_RATE_LIMIT_ROOM_BURST
+        )
+
+        if not await RateLimiter.take(user_bucket):
+            metrics.incr("ratelimit.dropped.user")
+            return user_bucket.retry_after()
+
+        if not await RateLimiter.take(room_bucket):
+            user_bucket.refund()
+            metrics.incr("ratelimit.dropped.room")
+            return room_bucket.retry_after()
+
+        metrics.incr("ratelimit.allowed")
+        return None
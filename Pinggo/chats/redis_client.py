@@ -0,0 +1,28 @@
+import redis.asyncio as aioredis
+from django.conf import settings
+from django_redis import get_redis_connection
+
+
+_async_client = None
+
+
+def get_redis():
+    return get_redis_connection("default")
+
+
+def get_async_redis():
+    """
+    Shared redis.asyncio client for code running on the event loop.
+    The pool is created on first use, not at import time.
+    """
+    global _async_client
+
+    if _async_client is None:
+        _async_client = aioredis.Redis(
+            connection_pool=aioredis.ConnectionPool.from_url(
+                settings.REDIS_URL,
+                max_connections=settings.REDIS_MAX_CONNECTIONS,
+            )
+        )
+
+    return _async_client
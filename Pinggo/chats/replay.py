@@ -0,0 +1,51 @@
+import json
+
+from django.conf import settings
+
+from .redis_client import get_redis, get_async_redis
+
+
+def replay_key(group_id):
+    return f"replay:{{{group_id}}}"
+
+
+class ReplayBuffer:
+    """
+    Bounded per-room ring buffer of broadcast message events, scored by seq.
+
+    A reconnecting client sends the last seq it saw and gets back only what
+    it missed. ``since`` returns ``None`` when the buffer no longer reaches
+    back that far, in which case the caller falls back to the database.
+    """
+
+    @staticmethod
+    def _push(pipe, group_id, event):
+        key = replay_key(group_id)
+        pipe.zadd(key, {json.dumps(event): event["seq"]})
+        pipe.zremrangebyrank(key, 0, -settings.CHAT_REPLAY_BUFFER_SIZE - 1)
+
+    @staticmethod
+    async def push(group_id, event):
+        async with get_async_redis().pipeline(transaction=False) as pipe:
+            ReplayBuffer._push(pipe, group_id, event)
+            await pipe.execute()
+
+    @staticmethod
+    def push_sync(group_id, event):
+        pipe = get_redis().pipeline(transaction=False)
+        ReplayBuffer._push(pipe, group_id, event)
+        pipe.execute()
+
+    @staticmethod
+    async def since(group_id, last_seq):
+        key = replay_key(group_id)
+
+        async with get_async_redis().pipeline(transaction=False) as pipe:
+            pipe.zrange(key, 0, 0, withscores=True)
+            pipe.zrangebyscore(key, f"({last_seq}", "+inf")
+            oldest, missed = await pipe.execute()
+
+        if not oldest or oldest[0][1] > last_seq + 1:
+            return None
+
+        return [json.loads(event) for event in missed]
@@ -1,11 +1,27 @@
+from asgiref.sync import async_to_sync
 from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
 from django.db import transaction, IntegrityError
+from django.db.models import Exists, F, OuterRef, Prefetch, Q, Subquery
 from django.contrib.auth.models import User
 from django.shortcuts import get_object_or_404
 
+from users.services.cache_service import ReadThroughCache
 from users.services.user_service import UserService
 
-from ..models import ChatGroup
+from ..models import ChatGroup, ChatMembership
+from ..utility import encode_cursor, history_window, room_group_name
+
+
+MESSAGE_PAGE_SIZE = 60
+
+# Invalidated in chats.signals.
+chat_cache = ReadThroughCache("chat")
+members_cache = ReadThroughCache("chat-members")
+
+
+def chat_cache_key(chat_type, chat_name):
+    return f"{chat_type}:{chat_name}"
 
 
 class ChatService:
@@ -19,28 +35,79 @@ class ChatService:
 
 
     @staticmethod
-    async def async_get_chat(chat_name): # DON'T TOUCH IT, IT WORKS WITH CONSUMER
-        return await database_sync_to_async(ChatGroup.objects.get)(
-            group_name=chat_name
+    async def async_get_chat(chat_type, chat_name):
+        return await chat_cache.aget(
+            chat_cache_key(chat_type, chat_name),
+            lambda: ChatService.load_chat(chat_type, chat_name),
+        )
+
+
+    @staticmethod
+    def authorize(chat_type, chat_name, user):
+        """
+        Resolve a chat by (type, name) together with ``is_member`` for
+        ``user`` in a single query. Returns None when the chat doesn't exist.
+        """
+        membership = ChatMembership.objects.filter(
+            chatgroup_id=OuterRef("pk"),
+            user_id=user.id,
         )
 
+        return ChatGroup.objects.filter(
+            chat_type=chat_type,
+            group_name=chat_name,
+        ).annotate(is_member=Exists(membership)).first()
+
+
+    @staticmethod
+    async def async_authorize(chat_type, chat_name, user):
+        return await database_sync_to_async(ChatService.authorize)(chat_type, chat_name, user)
+
+
+    @staticmethod
+    def by_activity(chats):
+        return chats.order_by(F("last_message_at").desc(nulls_last=True), "-id")
+
+
+    @staticmethod
+    def get_member_chats(user, chat_type):
+        """
+        The user's chats of one type, most recently active first, each with
+        ``unread`` computed from the denormalized seqs: one indexed query, no
+        matter how many messages the rooms hold.
+        """
+        chats = ChatGroup.objects.filter(
+            chat_type=chat_type,
+            memberships__user=user,
+        ).annotate(
+            last_read_seq=F("memberships__last_read_seq"),
+            unread=F("last_seq") - F("memberships__last_read_seq"),
+        )
+
+        return ChatService.by_activity(chats)
+
 
     @staticmethod
     def get_global_chats():
-        return ChatGroup.objects.filter(chat_type="global")
+        return ChatService.by_activity(ChatGroup.objects.filter(chat_type="global").select_related("creator"))
 
 
     @staticmethod
     def get_group_chats(user):
-        return ChatGroup.objects.filter(chat_type="group", members=user)
+        return ChatService.get_member_chats(user, "group").select_related("creator")
 
 
     @staticmethod
     def get_private_chats(user):
-        private_chats = ChatGroup.objects.filter(
-            chat_type="private",
-            members=user
-        ).prefetch_related("members")
+        # Two queries regardless of how many DMs the user has: the chats, then
+        # every other participant with their profile.
+        private_chats = ChatService.get_member_chats(user, "private").prefetch_related(
+            Prefetch(
+                "members",
+                queryset=User.objects.exclude(id=user.id).select_related("profile"),
+                to_attr="other_members",
+            )
+        )
 
         return [
             {
@@ -51,6 +118,28 @@ class ChatService:
         ]
 
 
+    @staticmethod
+    def mark_read(chat, user_id, seq=None):
+        """
+        Move the user's read marker up to ``seq`` (default: the chat's latest
+        message). Never moves it backwards.
+        """
+        if seq is None:
+            # Read in the UPDATE itself: ``chat`` may be a cached copy.
+            seq = Subquery(ChatGroup.objects.filter(pk=chat.pk).values("last_seq"))
+
+        return ChatMembership.objects.filter(
+            chatgroup=chat,
+            user_id=user_id,
+            last_read_seq__lt=seq,
+        ).update(last_read_seq=seq)
+
+
+    @staticmethod
+    async def async_mark_read(chat, user_id, seq=None):
+        return await database_sync_to_async(ChatService.mark_read)(chat, user_id, seq)
+
+
     @staticmethod
     def get_chat_404(chat_type, chat_name):
         return get_object_or_404(
@@ -62,6 +151,17 @@ class ChatService:
 
     @staticmethod
     def get_chat(chat_type, chat_name):
+        """
+        Cached: seq and last-message fields may lag behind the database.
+        """
+        return chat_cache.get(
+            chat_cache_key(chat_type, chat_name),
+            lambda: ChatService.load_chat(chat_type, chat_name),
+        )
+
+
+    @staticmethod
+    def load_chat(chat_type, chat_name):
         return ChatGroup.objects.filter(
             chat_type=chat_type,
             group_name=chat_name,
@@ -80,17 +180,66 @@ class ChatService:
 
     @staticmethod
     def get_members_username(chat):
-        return chat.members.values_list("username", flat=True)
+        return members_cache.get(chat.id, lambda: list(chat.members.values_list("username", flat=True)))
 
 
     @staticmethod
     def get_other_member(user_id, chat):
-        return chat.members.exclude(id=user_id).first()
+        if hasattr(chat, "other_members"):
+            return chat.other_members[0] if chat.other_members else None
+
+        return chat.members.exclude(id=user_id).select_related("profile").first()
 
 
     @staticmethod
-    def get_chat_messages(chat):
-        return chat.chat_messages.select_related("author").order_by("created_at")[:60]
+    def get_chat_messages(chat, before=None, after=None, limit=MESSAGE_PAGE_SIZE):
+        """
+        Keyset page over (group, created_at, id). With no cursor this is the
+        newest page; ``before``/``after`` are decoded (created_at, id) cursors.
+        Messages are always returned oldest first.
+
+        Every query has a created_at lower bound, so a partitioned table
+        only scans the partitions it needs: ``after`` pages start at their
+        cursor, the others look within history_window() first.
+        """
+        chat_messages = chat.chat_messages.select_related("author__profile")
+
+        if after:
+            created_at, message_id = after
+            page = list(
+                chat_messages.filter(created_at__gte=created_at)
+                .filter(Q(created_at__gt=created_at) | Q(id__gt=message_id))
+                .order_by("created_at", "id")[:limit + 1]
+            )
+            has_more = len(page) > limit
+            page = page[:limit]
+        else:
+            until = None
+            if before:
+                until, message_id = before
+                chat_messages = chat_messages.filter(created_at__lte=until).filter(
+                    Q(created_at__lt=until) | Q(id__lt=message_id)
+                )
+
+            newest_first = chat_messages.order_by("-created_at", "-id")
+            since = history_window(chat, until)
+            page = list(newest_first.filter(created_at__gte=since)[:limit + 1])
+
+            if len(page) <= limit:
+                # Quiet room or the start of its history: carry on before
+                # the window.
+                page += newest_first.filter(created_at__lt=since)[:limit + 1 - len(page)]
+
+            has_more = len(page) > limit
+            page = page[:limit][::-1]
+
+        return {
+            "messages": page,
+            "has_more": has_more,
+            "direction": "after" if after else "before",
+            "before": encode_cursor(page[0]) if page else None,
+            "after": encode_cursor(page[-1]) if page else None,
+        }
 
 
     @staticmethod
@@ -125,6 +274,7 @@ class ChatService:
     def update_group(group, group_name, description, image, members):
         try:
             with transaction.atomic():
+                old_group_name = group.group_name
 
                 group.group_name = group_name
                 group.description = description
@@ -132,18 +282,60 @@ class ChatService:
                 if image:
                     group.image_url = image
 
+                removed = added = set()
+
                 if group.chat_type == "group":
+                    old_ids = set(group.members.values_list("id", flat=True))
+
                     users = list(UserService.get_users_object(members))
                     users.append(group.creator)
                     group.members.set(users)
 
+                    new_ids = {user.id for user in users}
+                    removed, added = old_ids - new_ids, new_ids - old_ids
+
                 group.save()
 
+                if group.group_name != old_group_name:
+                    ChatService.notify_room(group.chat_type, old_group_name, {"type": "chat_renamed_handler"})
+                elif removed or added:
+                    ChatService.notify_membership_changed(group.chat_type, group.group_name, removed, added)
+
                 return True
         except IntegrityError:
             return False
 
 
+    @staticmethod
+    def leave_group(chat, user):
+        with transaction.atomic():
+            chat.members.remove(user)
+            ChatService.notify_membership_changed(chat.chat_type, chat.group_name, removed=[user.id])
+
+
+    @staticmethod
+    def notify_room(chat_type, chat_name, event):
+        """
+        Send a control event to the room's live consumers once the current
+        transaction commits, so they never act on a rolled-back change.
+        """
+        group_name = room_group_name(chat_type, chat_name)
+
+        transaction.on_commit(
+            lambda: async_to_sync(get_channel_layer().group_send)(group_name, event)
+        )
+
+
+    @staticmethod
+    def notify_membership_changed(chat_type, chat_name, removed=(), added=()):
+        # Consumers update their cached membership from the ids alone.
+        ChatService.notify_room(chat_type, chat_name, {
+            "type": "membership_handler",
+            "removed": list(removed),
+            "added": list(added),
+        })
+
+
     @staticmethod
     def get_or_create_private_chat(group_name, current_user, other_user):
         with transaction.atomic():
@@ -166,5 +358,10 @@ class ChatService:
 
     @staticmethod
     def delete_group(chat_type, group_name):
-        deleted_count, _ = ChatGroup.objects.filter(chat_type=chat_type, group_name=group_name).delete()
+        with transaction.atomic():
+            deleted_count, _ = ChatGroup.objects.filter(chat_type=chat_type, group_name=group_name).delete()
+
+            if deleted_count:
+                ChatService.notify_room(chat_type, group_name, {"type": "chat_deleted_handler"})
+
         return deleted_count
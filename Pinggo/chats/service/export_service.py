@@ -0,0 +1,145 @@
+import csv
+import json
+import zlib
+
+from asgiref.sync import sync_to_async
+
+from ..models import GroupMessage
+
+
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_FIELDS = ["id", "seq", "created_at", "author", "message", "file_url", "file_type", "file_name"]
+
+# Compressed output is flushed once this much has been produced, so the
+# client sees steady progress without a write per row.
+GZIP_FLUSH_SIZE = 64 * 1024
+
+# Roughly how much aexport hands the server per trip to the worker thread.
+STREAM_BATCH_SIZE = 64 * 1024
+
+
+class _Echo:
+    """
+    File-like object for csv.writer that hands each row back instead of
+    buffering it.
+    """
+
+    def write(self, value):
+        return value
+
+
+class ExportService:
+
+    @staticmethod
+    def rows(chat):
+        """
+        The chat's messages oldest first, as plain tuples off a server-side
+        cursor: memory stays flat however large the room is.
+        """
+        return (
+            GroupMessage.objects.filter(group=chat)
+            .order_by("created_at", "id")
+            .values_list(
+                "id", "seq", "created_at", "author__username",
+                "message", "file_url", "file_type", "file_name",
+            )
+            .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+        )
+
+
+    @staticmethod
+    def ndjson(rows):
+        for row in rows:
+            record = dict(zip(EXPORT_FIELDS, row))
+            record["created_at"] = record["created_at"].isoformat()
+            yield json.dumps(record, ensure_ascii=False) + "\n"
+
+
+    @staticmethod
+    def csv(rows):
+        writer = csv.writer(_Echo())
+        yield writer.writerow(EXPORT_FIELDS)
+
+        for row in rows:
+            yield writer.writerow(row[:2] + (row[2].isoformat(),) + row[3:])
+
+
+    @staticmethod
+    def gzip(chunks):
+        compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+        pending = []
+        size = 0
+
+        for chunk in chunks:
+            data = compressor.compress(chunk.encode())
+            if data:
+                pending.append(data)
+                size += len(data)
+
+            if size >= GZIP_FLUSH_SIZE:
+                yield b"".join(pending)
+                pending, size = [], 0
+
+        pending.append(compressor.flush())
+        yield b"".join(pending)
+
+
+    @staticmethod
+    def export(chat, fmt="ndjson", compress=False):
+        """
+        Iterable of the export's chunks: text, or bytes when ``compress``.
+        """
+        rows = ExportService.rows(chat)
+        chunks = ExportService.csv(rows) if fmt == "csv" else ExportService.ndjson(rows)
+
+        if compress:
+            return ExportService.gzip(chunks)
+        return chunks
+
+
+    @staticmethod
+    def next_batch(chunks):
+        """
+        Join chunks off ``chunks`` until about STREAM_BATCH_SIZE; empty once
+        the export is done.
+        """
+        batch = []
+        size = 0
+
+        for chunk in chunks:
+            batch.append(chunk)
+            size += len(chunk)
+
+            if size >= STREAM_BATCH_SIZE:
+                break
+
+        if not batch:
+            return None
+        if isinstance(batch[0], bytes):
+            return b"".join(batch)
+        return "".join(batch)
+
+
+    @staticmethod
+    async def aexport(chat, fmt="ndjson", compress=False):
+        """
+        ``export`` as an async iterator, for StreamingHttpResponse under
+        ASGI. Given a sync iterator, Django's ASGI handler would read the
+        whole export into memory with sync_to_async(list) first; this pulls
+        one batch at a time instead. The query and the encoding stay sync
+        and run on the request's thread, which also owns the cursor.
+        """
+        chunks = ExportService.export(chat, fmt, compress)
+        next_batch = sync_to_async(ExportService.next_batch)
+
+        try:
+            while (batch := await next_batch(chunks)) is not None:
+                yield batch
+        finally:
+            # Releases the server-side cursor if the client went away.
+            await sync_to_async(chunks.close)()
+
+
+    @staticmethod
+    def filename(chat, fmt="ndjson", compress=False):
+        return f"{chat.group_name}.{fmt}" + (".gz" if compress else "")
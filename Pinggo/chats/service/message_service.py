@@ -1,6 +1,18 @@
+from asgiref.sync import async_to_sync
 from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import connection, transaction
+from django.template.loader import render_to_string
 
-from chats.models import GroupMessage
+from Pinggo.db_router import amark_sticky
+from chats.models import ChatGroup, GroupMessage
+from ..replay import ReplayBuffer
+from ..utility import history_window, room_group_name
+from .write_behind import message_write_behind
+
+
+MESSAGE_PARTIAL = "chats/partials/chat_message_p.html"
 
 
 class MessageService:
@@ -15,23 +27,55 @@ class MessageService:
     """
 
     @staticmethod
-    async def get_message(message_id):
-        return await database_sync_to_async(GroupMessage.objects.select_related("author").get)(
-            id=message_id
-        )
+    def next_seq(group, message):
+        """
+        Allocate the group's next message seq and record ``message`` as the
+        group's latest, in one UPDATE. Must run in the same transaction as
+        the insert: the row lock keeps seqs gap-free.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {ChatGroup._meta.db_table} SET last_seq = last_seq + 1, "
+                f"last_message_at = %s, last_message_preview = %s "
+                f"WHERE id = %s RETURNING last_seq",
+                [message.created_at, message.preview, group.pk],
+            )
+            return cursor.fetchone()[0]
 
 
     @staticmethod
     async def create_message(user, group, message):
-        return await database_sync_to_async(GroupMessage.objects.create)(
-            message=message,
-            author=user,
+        # The poster's next history load must see this message.
+        await amark_sticky(user.id)
+
+        if settings.CHAT_WRITE_BEHIND:
+            return await message_write_behind.create_message(user, group, message)
+
+        return await database_sync_to_async(MessageService.create_message_unchecked)(
+            user=user,
             group=group,
+            message=message,
         )
 
+    @staticmethod
+    def create_message_unchecked(user, group, message):
+        """
+        Hot path for the consumer: a single INSERT with no full_clean(). The
+        caller is responsible for having checked that ``user`` may post.
+        """
+        with transaction.atomic():
+            chat_message = GroupMessage(
+                message=message,
+                author=user,
+                group=group,
+            )
+            chat_message.seq = MessageService.next_seq(group, chat_message)
+            chat_message.save(force_insert=True, validate=False)
+        return chat_message
+
     @staticmethod
     def create_message_upload(user, group, message, file_url, file_type, file_name):
-        return GroupMessage.objects.create(
+        chat_message = GroupMessage(
             group=group,
             author=user,
             message=message,
@@ -39,3 +83,117 @@ class MessageService:
             file_type=file_type,
             file_name=file_name,
         )
+
+        if settings.CHAT_WRITE_BEHIND:
+            # The room's seqs come from the write-behind counter, which
+            # pending socket messages are already numbered from.
+            chat_message.seq = message_write_behind.next_seq_sync(group)
+            with transaction.atomic():
+                chat_message.save(force_insert=True)
+                message_write_behind.record_latest([chat_message])
+            return chat_message
+
+        with transaction.atomic():
+            chat_message.seq = MessageService.next_seq(group, chat_message)
+            chat_message.save(force_insert=True)
+        return chat_message
+
+
+    @staticmethod
+    def get_messages_since(group, last_seq, limit):
+        """
+        Up to ``limit`` messages after ``last_seq``, oldest first. Looks
+        within history_window() first, so a partitioned table only scans
+        its newest partitions; older ones only when the window doesn't
+        reach back to ``last_seq``.
+        """
+        messages = (
+            GroupMessage.objects.filter(group=group, seq__gt=last_seq)
+            .select_related("author__profile")
+            .order_by("seq")
+        )
+        since = history_window(group)
+        recent = list(messages.filter(created_at__gte=since)[:limit])
+
+        if recent:
+            if recent[0].seq == last_seq + 1:
+                return recent
+        elif group.last_seq <= last_seq:
+            return recent
+
+        older = list(messages.filter(created_at__lt=since)[:limit])
+        return sorted(older + recent, key=lambda message: message.seq)[:limit]
+
+
+    @staticmethod
+    def render_message(message, chat_type, viewer):
+        return render_to_string(
+            MESSAGE_PARTIAL,
+            {"message": message, "active_type": chat_type, "user": viewer},
+        )
+
+
+    @staticmethod
+    def serialize_message(message):
+        """
+        Compact form of a message for the JSON/msgpack protocols.
+        """
+        author = message.author
+        data = {
+            "id": message.id,
+            "seq": message.seq,
+            "created_at": message.created_at.isoformat(),
+            "author": {
+                "id": author.id,
+                "username": author.username,
+                "name": author.profile.name,
+                "avatar": author.profile.avatar,
+            },
+            "message": message.message or "",
+        }
+
+        if message.file_url:
+            data["file"] = {
+                "url": message.file_url,
+                "type": message.file_type,
+                "name": message.file_name,
+            }
+
+        return data
+
+
+    @staticmethod
+    def build_message_event(message, chat_type):
+        """
+        Render a message once per viewer variant so the room fan-out only has
+        to pick a string: the author gets the "own" bubble, everyone else
+        gets the "other" one.
+        """
+        return {
+            "type": "message_handler",
+            "message_id": message.id,
+            "seq": message.seq,
+            "author_id": message.author_id,
+            "own_html": MessageService.render_message(message, chat_type, message.author),
+            "other_html": MessageService.render_message(message, chat_type, None),
+            "data": MessageService.serialize_message(message),
+        }
+
+
+    @staticmethod
+    async def async_build_message_event(message, chat_type):
+        return await database_sync_to_async(MessageService.build_message_event)(message, chat_type)
+
+
+    @staticmethod
+    async def publish(message, chat_type, chat_name):
+        event = await MessageService.async_build_message_event(message, chat_type)
+        await ReplayBuffer.push(message.group_id, event)
+        await get_channel_layer().group_send(room_group_name(chat_type, chat_name), event)
+
+
+    @staticmethod
+    def publish_sync(message, chat_type, chat_name):
+        event = MessageService.build_message_event(message, chat_type)
+        ReplayBuffer.push_sync(message.group_id, event)
+        async_to_sync(get_channel_layer().group_send)(room_group_name(chat_type, chat_name), event)
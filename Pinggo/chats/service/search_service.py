@@ -0,0 +1,88 @@
+from django.contrib.postgres.search import SearchHeadline, SearchQuery
+from django.db.models import Q
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from ..models import SEARCH_CONFIG, ChatGroup, ChatMembership, GroupMessage
+from ..utility import encode_cursor
+
+
+SEARCH_PAGE_SIZE = 20
+
+# ts_headline doesn't escape the message, so matches are marked with control
+# characters and turned into <mark> only after escaping.
+HIGHLIGHT_START = "\x02"
+HIGHLIGHT_STOP = "\x03"
+
+
+class SearchService:
+
+    @staticmethod
+    def viewable_group_ids(user):
+        """
+        Ids of every chat ``user`` can read: all global chats plus the ones
+        they are a member of. Small, and lets the search hit the
+        (group, search_vector) index directly.
+        """
+        global_ids = ChatGroup.objects.filter(chat_type="global").values_list("id", flat=True)
+        member_ids = ChatMembership.objects.filter(user=user).values_list("chatgroup_id", flat=True)
+        return list(global_ids.union(member_ids))
+
+
+    @staticmethod
+    def highlight(headline):
+        return mark_safe(
+            escape(headline)
+            .replace(HIGHLIGHT_START, "<mark>")
+            .replace(HIGHLIGHT_STOP, "</mark>")
+        )
+
+
+    @staticmethod
+    def search_messages(user, text, chat=None, before=None, limit=SEARCH_PAGE_SIZE):
+        """
+        Newest-first keyset page of messages matching ``text`` (websearch
+        syntax) in the chats ``user`` can view, or in ``chat`` only.
+        ``before`` is a decoded (created_at, id) cursor.
+        """
+        query = SearchQuery(text, search_type="websearch", config=SEARCH_CONFIG)
+
+        group_ids = [chat.id] if chat else SearchService.viewable_group_ids(user)
+
+        messages = GroupMessage.objects.filter(
+            group_id__in=group_ids,
+            search_vector=query,
+        ).select_related("author__profile", "group")
+
+        if before:
+            created_at, message_id = before
+            messages = messages.filter(created_at__lte=created_at).filter(
+                Q(created_at__lt=created_at) | Q(id__lt=message_id)
+            )
+
+        # The headline is computed for the returned page only: Postgres
+        # evaluates it after the sort and LIMIT.
+        page = list(
+            messages.annotate(
+                headline=SearchHeadline(
+                    "message",
+                    query,
+                    config=SEARCH_CONFIG,
+                    start_sel=HIGHLIGHT_START,
+                    stop_sel=HIGHLIGHT_STOP,
+                    max_fragments=2,
+                ),
+            ).order_by("-created_at", "-id")[:limit + 1]
+        )
+
+        has_more = len(page) > limit
+        page = page[:limit]
+
+        for message in page:
+            message.highlighted = SearchService.highlight(message.headline)
+
+        return {
+            "messages": page,
+            "has_more": has_more,
+            "before": encode_cursor(page[-1]) if page else None,
+        }
@@ -0,0 +1,255 @@
+import asyncio
+import atexit
+import logging
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+
+from chats.models import ChatGroup, GroupMessage
+from ..redis_client import get_async_redis, get_redis
+
+
+logger = logging.getLogger(__name__)
+
+# Per-room seq counter for write-behind mode, where the row (and so the
+# ChatGroup.last_seq bump) is written later. A missing key returns -1 so the
+# caller can seed it from the database; ARGV[1] is a known lower bound.
+SEQ_SCRIPT = """
+local current = redis.call('GET', KEYS[1])
+if not current and ARGV[2] ~= '1' then
+    return -1
+end
+if not current or tonumber(current) < tonumber(ARGV[1]) then
+    redis.call('SET', KEYS[1], ARGV[1])
+end
+return redis.call('INCR', KEYS[1])
+"""
+
+
+class MessageWriteBehind:
+    """
+    Batched persistence for consumer messages, used when CHAT_WRITE_BEHIND
+    is on.
+
+    Ids are reserved from the table's sequence a block at a time, so a
+    message can be broadcast before its row exists; per-room seqs come from
+    a Redis counter that ChatGroup.last_seq keeps a floor for. In this mode
+    every seq, including those of uploads, must come from that counter
+    (see ``next_seq_sync``): the database's last_seq lags the pending rows,
+    so allocating from it as well would hand out duplicates. A background task
+    flushes pending rows with bulk_create every CHAT_WRITE_BEHIND_INTERVAL
+    seconds, or as soon as CHAT_WRITE_BEHIND_BATCH_SIZE are waiting.
+    Because ids are fixed, a retried batch is idempotent.
+    """
+
+    def __init__(self):
+        self.pending = []
+        # The batch a flush is writing; kept until the write finishes so a
+        # shutdown mid-flush still writes it.
+        self.inflight = []
+        self.ids = []
+        self.id_lock = None
+        self.wakeup = None
+        self.flusher = None
+        self.seq_script = None
+        self.seq_script_sync = None
+        atexit.register(self.flush_sync)
+
+    @staticmethod
+    def reserve_ids(count):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s)",
+                [GroupMessage._meta.db_table, count],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    async def next_id(self):
+        if self.id_lock is None:
+            self.id_lock = asyncio.Lock()
+
+        async with self.id_lock:
+            if not self.ids:
+                self.ids = await database_sync_to_async(self.reserve_ids)(
+                    settings.CHAT_WRITE_BEHIND_BATCH_SIZE
+                )
+            return self.ids.pop(0)
+
+    @staticmethod
+    def db_last_seq(group):
+        return ChatGroup.objects.filter(pk=group.pk).values_list("last_seq", flat=True).get()
+
+    @staticmethod
+    def seq_key(group):
+        return f"chat:seq:{group.pk}"
+
+    async def next_seq(self, group):
+        if self.seq_script is None:
+            self.seq_script = get_async_redis().register_script(SEQ_SCRIPT)
+
+        key = self.seq_key(group)
+        seq = await self.seq_script(keys=[key], args=[group.last_seq, 0])
+
+        if seq == -1:
+            floor = await database_sync_to_async(self.db_last_seq)(group)
+            seq = await self.seq_script(keys=[key], args=[floor, 1])
+
+        return seq
+
+    def next_seq_sync(self, group):
+        """
+        ``next_seq`` for sync callers (file uploads), off the same counter.
+        """
+        if self.seq_script_sync is None:
+            self.seq_script_sync = get_redis().register_script(SEQ_SCRIPT)
+
+        key = self.seq_key(group)
+        seq = self.seq_script_sync(keys=[key], args=[group.last_seq, 0])
+
+        if seq == -1:
+            seq = self.seq_script_sync(keys=[key], args=[self.db_last_seq(group), 1])
+
+        return seq
+
+    async def create_message(self, user, group, message):
+        chat_message = GroupMessage(
+            id=await self.next_id(),
+            seq=await self.next_seq(group),
+            message=message,
+            author=user,
+            group=group,
+            created_at=timezone.now(),
+        )
+        self.add(chat_message)
+        return chat_message
+
+    def add(self, chat_message):
+        # Also restarts a flusher that died, rather than queue forever.
+        if self.flusher is None or self.flusher.done():
+            self.wakeup = asyncio.Event()
+            self.flusher = asyncio.create_task(self.run())
+
+        self.pending.append(chat_message)
+
+        if len(self.pending) >= settings.CHAT_WRITE_BEHIND_BATCH_SIZE:
+            self.wakeup.set()
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), settings.CHAT_WRITE_BEHIND_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+            self.wakeup.clear()
+
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Write-behind flush failed")
+
+    async def flush(self):
+        batch = self.inflight = self.pending
+        self.pending = []
+
+        if not batch:
+            return
+
+        for attempt in range(settings.CHAT_WRITE_BEHIND_RETRIES):
+            try:
+                failed = await database_sync_to_async(self.write)(batch)
+            except Exception:
+                logger.exception(
+                    "Can't write %s pending message(s), attempt %s of %s",
+                    len(batch), attempt + 1, settings.CHAT_WRITE_BEHIND_RETRIES,
+                )
+                await asyncio.sleep(0.1 * 2 ** attempt)
+            else:
+                self.pending[:0] = failed
+                self.inflight = []
+                return
+
+        # Still failing: keep the rows for the next flush rather than drop them.
+        self.pending[:0] = batch
+        self.inflight = []
+
+    @staticmethod
+    def write(batch):
+        """
+        Insert ``batch`` and return the rows that couldn't be written.
+        """
+        try:
+            with transaction.atomic():
+                GroupMessage.objects.bulk_create(batch)
+            failed = []
+        except IntegrityError:
+            # One bad row must not block the batch forever; insert the rest
+            # one by one.
+            failed = MessageWriteBehind.write_each(batch)
+
+        MessageWriteBehind.record_latest(batch)
+        return failed
+
+    @staticmethod
+    def write_each(batch):
+        failed = []
+
+        for chat_message in batch:
+            try:
+                with transaction.atomic():
+                    GroupMessage.objects.bulk_create([chat_message])
+                continue
+            except IntegrityError as e:
+                error = e
+
+            # A retried batch that had in fact been committed, or a row whose
+            # chat was deleted meanwhile (and its messages with it), is fine
+            # to skip. Anything else, like a seq collision, is a bug: keep
+            # the row and say so rather than lose a message that was already
+            # broadcast.
+            if GroupMessage.objects.filter(pk=chat_message.pk).exists():
+                continue
+
+            if not ChatGroup.objects.filter(pk=chat_message.group_id).exists():
+                logger.warning("Dropping message %s: chat %s no longer exists", chat_message.pk, chat_message.group_id)
+                continue
+
+            logger.error(
+                "Can't write message %s (chat %s, seq %s): %s",
+                chat_message.pk, chat_message.group_id, chat_message.seq, error,
+            )
+            failed.append(chat_message)
+
+        return failed
+
+    @staticmethod
+    def record_latest(messages):
+        # Keep ChatGroup.last_seq as the durable floor for the Redis counter,
+        # along with the sidebar's latest-message fields.
+        latest = {}
+        for chat_message in messages:
+            current = latest.get(chat_message.group_id)
+            if current is None or chat_message.seq > current.seq:
+                latest[chat_message.group_id] = chat_message
+
+        for group_id, chat_message in latest.items():
+            ChatGroup.objects.filter(pk=group_id, last_seq__lt=chat_message.seq).update(
+                last_seq=chat_message.seq,
+                last_message_at=chat_message.created_at,
+                last_message_preview=chat_message.preview,
+            )
+
+    def flush_sync(self):
+        # A batch that was in flight may have been committed already;
+        # write() skips rows that exist.
+        batch = self.inflight + self.pending
+        self.inflight, self.pending = [], []
+
+        if batch:
+            for chat_message in self.write(batch):
+                logger.error("Lost unwritten message %s on shutdown", chat_message.pk)
+
+
+message_write_behind = MessageWriteBehind()
@@ -0,0 +1,69 @@
+from django.db import connections
+from django.db.models import OuterRef, Subquery
+from django.db.models.signals import m2m_changed, post_delete, post_init, post_save, pre_migrate
+from django.dispatch import receiver
+
+from .models import ChatGroup, ChatMembership
+from .service.chat_service import chat_cache, chat_cache_key, members_cache
+
+
+@receiver(post_init, sender=ChatGroup)
+def chat_group_post_init(sender, instance, **kwargs):
+    # Remember the key the row was loaded under, so a rename also drops the
+    # entry cached under the old name.
+    instance._cache_key = chat_cache_key(instance.chat_type, instance.group_name)
+
+
+@receiver(post_save, sender=ChatGroup)
+@receiver(post_delete, sender=ChatGroup)
+def chat_group_changed(sender, instance, **kwargs):
+    key = chat_cache_key(instance.chat_type, instance.group_name)
+    chat_cache.invalidate(key, instance._cache_key)
+    members_cache.invalidate(instance.pk)
+    instance._cache_key = key
+
+
+@receiver(post_save, sender=ChatMembership)
+@receiver(post_delete, sender=ChatMembership)
+def chat_membership_changed(sender, instance, **kwargs):
+    members_cache.invalidate(instance.chatgroup_id)
+
+
+@receiver(m2m_changed, sender=ChatGroup.members.through)
+def chat_members_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == "post_add" and pk_set:
+        # A new member starts with nothing unread; pk_set only holds the
+        # memberships this add created.
+        if reverse:
+            added = ChatMembership.objects.filter(user=instance, chatgroup_id__in=pk_set)
+        else:
+            added = ChatMembership.objects.filter(chatgroup=instance, user_id__in=pk_set)
+
+        added.update(last_read_seq=Subquery(
+            ChatGroup.objects.filter(pk=OuterRef("chatgroup_id")).values("last_seq")[:1]
+        ))
+
+    if not reverse:
+        if action.startswith("post_"):
+            members_cache.invalidate(instance.pk)
+    elif action == "pre_clear":
+        # user.chat_groups.clear() doesn't pass the chats; look them up first.
+        members_cache.invalidate(*instance.chat_groups.values_list("pk", flat=True))
+    elif action.startswith("post_") and pk_set:
+        members_cache.invalidate(*pk_set)
+
+
+@receiver(pre_migrate)
+def chats_pre_migrate(sender, app_config=None, using="default", **kwargs):
+    # chat_msg_search_idx puts a plain column in a GIN index, which needs
+    # btree_gin. Created here since the app's migrations aren't checked in.
+    if app_config is None or app_config.name != "chats":
+        return
+
+    connection = connections[using]
+
+    if connection.vendor != "postgresql":
+        return
+
+    with connection.cursor() as cursor:
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS btree_gin")
@@ -0,0 +1,434 @@
+from allauth.account.models import EmailAddress
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, migrations, transaction
+from django.db.migrations.state import ProjectState
+from django.template.loader import render_to_string
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from datetime import timedelta
+from io import StringIO
+from unittest import skipUnless
+from unittest.mock import AsyncMock, patch
+import asyncio
+import gzip
+import json
+import tracemalloc
+
+from chats.consumers import ChatroomConsumer
+from chats.management.commands.partition_messages import add_months, month_start
+from chats.models import ChatGroup, GroupMessage
+from chats.outbox import MESSAGE, TYPING, Outbox, report_outboxes
+from chats.partition_migration import UnlessPartitioned, is_partitioned
+from chats.ratelimit import LeasedBucket, RateLimiter
+from chats.service.chat_service import ChatService
+from chats.service.message_service import MessageService
+from users.services.email_service import EmailService
+
+
+# Local storages: no Cloudinary account and no collectstatic manifest.
+TEST_STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.InMemoryStorage"},
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+}
+
+
+@override_settings(STORAGES=TEST_STORAGES)
+class PrivateChatSidebarTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("alice")
+        cls.add_private_chats(3)
+
+    @classmethod
+    def add_private_chats(cls, count):
+        start = cls.user.chat_groups.count()
+        for i in range(start, start + count):
+            friend = User.objects.create_user(f"friend{i}")
+            ChatService.get_or_create_private_chat(f"alice-{friend.username}", cls.user, friend)
+
+    def render_sidebar(self):
+        return render_to_string(
+            "chats/chat_names.html",
+            {"active_type": "private", "private_chats": ChatService.get_private_chats(self.user)},
+        )
+
+    def test_sidebar_renders_other_member_of_each_chat(self):
+        html = self.render_sidebar()
+
+        for i in range(3):
+            self.assertIn(f"Friend{i}", html)
+        self.assertNotIn("Alice", html)
+
+    def test_sidebar_queries_do_not_grow_with_chats(self):
+        with self.assertNumQueries(2):
+            self.render_sidebar()
+
+        self.add_private_chats(20)
+
+        with self.assertNumQueries(2):
+            html = self.render_sidebar()
+        self.assertEqual(html.count("/chat/private/"), 23)
+
+
+@override_settings(STORAGES=TEST_STORAGES)
+class NewMemberUnreadTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user("owner")
+        cls.chat = ChatGroup.objects.create(group_name="busy-room", chat_type="group", creator=cls.owner)
+        ChatGroup.objects.filter(pk=cls.chat.pk).update(last_seq=40)
+
+    def unread(self, user):
+        return {chat.group_name: chat.unread for chat in ChatService.get_member_chats(user, "group")}
+
+    def test_member_added_to_room_with_history_has_nothing_unread(self):
+        newcomer = User.objects.create_user("newcomer")
+        self.chat.members.add(newcomer)
+
+        self.assertEqual(self.unread(newcomer), {"busy-room": 0})
+        # The owner joined before any message; their backlog is untouched.
+        self.assertEqual(self.unread(self.owner), {"busy-room": 40})
+
+    def test_joining_from_the_user_side(self):
+        newcomer = User.objects.create_user("newcomer")
+        newcomer.chat_groups.add(self.chat)
+
+        self.assertEqual(self.unread(newcomer), {"busy-room": 0})
+
+
+class FakeConsumer:
+    channel_name = "test.channel"
+
+    def __init__(self):
+        self.sent = []
+        self.closed = None
+
+    async def send(self, text_data=None, bytes_data=None):
+        self.sent.append(text_data)
+
+    async def close(self, code=None):
+        self.closed = code
+
+
+class OutboxFlowControlTests(SimpleTestCase):
+
+    def outbox(self, window=4, high_water=5, limit=10):
+        self.consumer = FakeConsumer()
+        outbox = Outbox(
+            self.consumer, "room", high_water=high_water, limit=limit, overflow_code=4409, window=window
+        )
+        self.addCleanup(outbox.stop)
+        return outbox
+
+    @staticmethod
+    async def settle():
+        for _ in range(10):
+            await asyncio.sleep(0)
+
+    @staticmethod
+    def put_messages(outbox, count):
+        for i in range(count):
+            outbox.put(MESSAGE, {"text_data": f"message {i}"})
+
+    async def test_client_that_never_acks_is_not_held_back(self):
+        outbox = self.outbox()
+
+        self.put_messages(outbox, 10)
+        await self.settle()
+
+        self.assertEqual(len(self.consumer.sent), 10)
+        self.assertIsNone(outbox.unacked())
+
+    async def test_window_holds_frames_until_acked(self):
+        outbox = self.outbox()
+        self.put_messages(outbox, 1)
+        await self.settle()
+        outbox.ack(1)
+
+        self.put_messages(outbox, 10)
+        await self.settle()
+
+        self.assertEqual(len(self.consumer.sent), 5)
+        self.assertEqual(len(outbox), 6)
+        self.assertEqual(outbox.unacked(), 4)
+
+        outbox.ack(5)
+        await self.settle()
+
+        self.assertEqual(len(self.consumer.sent), 9)
+        self.assertEqual(len(outbox), 2)
+
+    async def test_reader_that_stops_acking_is_dropped_then_closed(self):
+        outbox = self.outbox()
+        outbox.ack(0)
+
+        self.put_messages(outbox, 4 + 5)
+        outbox.put(TYPING, {"text_data": "typing"})
+        await self.settle()
+
+        # The window is full, so the rest waits here and typing is shed.
+        self.assertEqual(len(self.consumer.sent), 4)
+        self.assertEqual(len(outbox), 5)
+        self.assertNotIn("typing", [frame["text_data"] for _, frame in outbox.frames])
+
+        self.put_messages(outbox, 6)
+        await self.settle()
+
+        self.assertEqual(self.consumer.closed, 4409)
+        self.assertEqual(len(self.consumer.sent), 4)
+
+    async def test_report_shows_depth_and_unacked(self):
+        outbox = self.outbox()
+        outbox.ack(0)
+        self.put_messages(outbox, 7)
+        await self.settle()
+
+        row = next(row for row in Outbox.report() if row["channel"] == "test.channel")
+        self.assertEqual((row["depth"], row["peak"], row["unacked"]), (3, 7, 4))
+
+        report = report_outboxes()
+        self.assertGreaterEqual(report["connections"], 1)
+        self.assertGreaterEqual(report["queued"], 3)
+
+
+class RemovedMemberTests(SimpleTestCase):
+
+    async def test_messages_are_dropped_once_removed(self):
+        consumer = ChatroomConsumer()
+        consumer.user = User(id=1, username="alice")
+        consumer.room_group_name = "group-room"
+        consumer.chatroom = ChatGroup(chat_type="group", group_name="room")
+        consumer.chatroom.is_member = True
+        consumer.outbox = Outbox(FakeConsumer(), "room", high_water=5, limit=10, overflow_code=4409, window=4)
+        self.addCleanup(consumer.outbox.stop)
+
+        await consumer.membership_handler({"removed": [1], "added": []})
+
+        with (
+            patch("chats.consumers.RateLimiter.check", AsyncMock()) as check,
+            patch("chats.consumers.MessageService.create_message", AsyncMock()) as create,
+        ):
+            await consumer.receive(text_data=json.dumps({"message": "still here?"}))
+
+        check.assert_not_awaited()
+        create.assert_not_awaited()
+
+
+@override_settings(PRESENCE_HEARTBEAT_INTERVAL=0)
+class HeartbeatTests(SimpleTestCase):
+
+    async def test_heartbeat_survives_a_failed_beat(self):
+        consumer = ChatroomConsumer()
+        consumer.user = User(id=1, username="alice")
+        consumer.chatroom_type, consumer.chatroom_name = "group", "room"
+        consumer.channel_name = "test.channel"
+        consumer.online_count = 0
+
+        beat = AsyncMock(side_effect=[ConnectionError("redis down"), 1, 1])
+
+        with patch("chats.consumers.AsyncPresence.heartbeat", beat), self.assertLogs("chats.consumers", "ERROR"):
+            task = asyncio.create_task(consumer.heartbeat())
+            for _ in range(10):
+                await asyncio.sleep(0)
+
+            self.assertFalse(task.done())
+            task.cancel()
+
+        self.assertGreaterEqual(beat.await_count, 2)
+
+
+class LeasedBucketTests(SimpleTestCase):
+
+    async def test_unspent_tokens_of_expired_lease_are_returned(self):
+        bucket = LeasedBucket("ratelimit:room:test", rate=20, burst=50, lease=5)
+
+        with patch.object(RateLimiter, "lease", AsyncMock(return_value=5)) as lease:
+            self.assertTrue(await bucket.acquire())
+            self.assertTrue(await bucket.acquire())
+            lease.assert_awaited_once_with("ratelimit:room:test", 20, 50, 5, 0)
+
+            bucket.expires = 0
+            self.assertTrue(await bucket.acquire())
+
+        # The 3 left over go back with the next lease instead of being lost.
+        lease.assert_awaited_with("ratelimit:room:test", 20, 50, 5, 3)
+        self.assertEqual(bucket.tokens, 4)
+
+
+@override_settings(
+    CHAT_RATE_LIMIT_ENABLED=True,
+    CHAT_RATE_LIMIT_SHARED=False,
+    CHAT_RATE_LIMIT_USER_RATE=0.001,
+    CHAT_RATE_LIMIT_USER_BURST=3,
+    CHAT_RATE_LIMIT_ROOM_RATE=0.001,
+    CHAT_RATE_LIMIT_ROOM_BURST=2,
+)
+class RateLimiterTests(SimpleTestCase):
+
+    def setUp(self):
+        RateLimiter.buckets.clear()
+        self.addCleanup(RateLimiter.buckets.clear)
+
+    async def test_room_rejection_does_not_cost_the_sender(self):
+        self.assertIsNone(await RateLimiter.check(1, "room"))
+        self.assertIsNone(await RateLimiter.check(2, "room"))
+
+        # The room is spent; user 1 keeps trying and is turned away by it.
+        for _ in range(5):
+            self.assertIsNotNone(await RateLimiter.check(1, "room"))
+
+        self.assertEqual(int(RateLimiter.buckets["user:1"].tokens), 2)
+        self.assertIsNone(await RateLimiter.check(1, "other-room"))
+
+
+@override_settings(STORAGES=TEST_STORAGES)
+class ChatExportTests(TestCase):
+
+    ROWS = 25_000
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("exporter", "exporter@example.com")
+        EmailAddress.objects.create(user=cls.user, email=cls.user.email, verified=True, primary=True)
+        chat = ChatGroup.objects.create(group_name="export-room", chat_type="group", creator=cls.user)
+        GroupMessage.objects.bulk_create(
+            GroupMessage(group=chat, author=cls.user, message=f"{seq} " + "x" * 1000, seq=seq)
+            for seq in range(1, cls.ROWS + 1)
+        )
+
+    def setUp(self):
+        # Chat pages need a verified email, which is cached per user id.
+        cache.delete(EmailService.email_verified_cache_key(self.user.id))
+
+    async def export(self, query=""):
+        await self.async_client.aforce_login(self.user)
+        return await self.async_client.get(reverse("export_chat", args=["group", "export-room"]) + query)
+
+    async def test_export_streams_in_bounded_memory(self):
+        response = await self.export()
+        self.assertTrue(response.is_async)
+
+        size = lines = 0
+        tracemalloc.start()
+        try:
+            async for chunk in response.streaming_content:
+                size += len(chunk)
+                lines += chunk.count(b"\n")
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        self.assertEqual(lines, self.ROWS)
+        # About 25 MB of NDJSON. Buffered before sending, the peak would
+        # exceed that; streamed, it is about one cursor fetch.
+        self.assertGreater(size, 25_000_000)
+        self.assertLess(peak, size / 3)
+
+    async def test_gzip_export(self):
+        response = await self.export("?format=csv&gzip=1")
+        body = b"".join([chunk async for chunk in response.streaming_content])
+
+        self.assertEqual(response["Content-Type"], "application/gzip")
+        self.assertEqual(gzip.decompress(body).decode().count("\r\n"), self.ROWS + 1)
+
+
+@skipUnless(connection.vendor == "postgresql", "partitioning needs Postgres")
+@override_settings(STORAGES=TEST_STORAGES, CHAT_HISTORY_WINDOW_DAYS=7)
+class PartitionPruningTests(TestCase):
+    """
+    Runs "partition_messages convert" inside the test transaction: everything
+    up to next month lands in the legacy partition, the rest in monthly ones.
+    """
+
+    def setUp(self):
+        call_command("partition_messages", "convert", "--months-ahead=3", stdout=StringIO())
+
+        user = User.objects.create_user("pruner")
+        self.chat = ChatGroup.objects.create(group_name="pruned-room", chat_type="group", creator=user)
+
+        # Three messages in the legacy partition, four in the month after
+        # next. The newest page and a replay from seq 3 only need the latter.
+        self.month = add_months(month_start(timezone.now()), 2)
+        old = timezone.now() - timedelta(days=30)
+        new = self.month + timedelta(days=10)
+        created = [old + timedelta(minutes=i) for i in range(3)] + [new + timedelta(minutes=i) for i in range(4)]
+
+        GroupMessage.objects.bulk_create(
+            GroupMessage(group=self.chat, author=user, message=f"m{seq}", seq=seq, created_at=created_at)
+            for seq, created_at in enumerate(created, start=1)
+        )
+        self.chat.last_seq = 7
+        self.chat.last_message_at = created[-1]
+
+    def plan(self, fetch):
+        with CaptureQueriesContext(connection) as queries:
+            result = fetch()
+
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN {queries[0]['sql']}")
+            return result, len(queries), "\n".join(row[0] for row in cursor.fetchall())
+
+    def assert_pruned(self, plan):
+        self.assertIn(f"{GroupMessage._meta.db_table}_p{self.month:%Y%m}", plan)
+        self.assertNotIn("_legacy", plan)
+
+    def test_newest_page_only_scans_recent_partitions(self):
+        history, queries, plan = self.plan(lambda: ChatService.get_chat_messages(self.chat, limit=3))
+
+        self.assertEqual([m.seq for m in history["messages"]], [5, 6, 7])
+        self.assertEqual(queries, 1)
+        self.assert_pruned(plan)
+
+    def test_replay_only_scans_recent_partitions(self):
+        messages, queries, plan = self.plan(lambda: MessageService.get_messages_since(self.chat, 3, 10))
+
+        self.assertEqual([m.seq for m in messages], [4, 5, 6, 7])
+        self.assertEqual(queries, 1)
+        self.assert_pruned(plan)
+
+    def test_short_window_falls_back_to_older_partitions(self):
+        history = ChatService.get_chat_messages(self.chat, limit=10)
+        self.assertEqual([m.seq for m in history["messages"]], list(range(1, 8)))
+        self.assertFalse(history["has_more"])
+
+        messages = MessageService.get_messages_since(self.chat, 1, 10)
+        self.assertEqual([m.seq for m in messages], list(range(2, 8)))
+
+
+@skipUnless(connection.vendor == "postgresql", "partitioning needs Postgres")
+class UnlessPartitionedTests(TestCase):
+
+    operation = migrations.RemoveConstraint(model_name="groupmessage", name="chat_msg_group_seq_uniq")
+
+    def migrate(self, operation):
+        from_state = ProjectState.from_apps(apps)
+        to_state = from_state.clone()
+        operation.state_forwards("chats", to_state)
+
+        with connection.schema_editor() as editor:
+            operation.database_forwards("chats", editor, from_state, to_state)
+        return to_state
+
+    def test_skips_the_database_once_partitioned(self):
+        call_command("partition_messages", "convert", stdout=StringIO())
+        self.assertTrue(is_partitioned(connection))
+
+        with self.assertRaises(Exception), transaction.atomic():
+            self.migrate(self.operation)
+
+        state = self.migrate(UnlessPartitioned([self.operation]))
+        self.assertEqual(state.models["chats", "groupmessage"].options["constraints"], [])
+
+    def test_runs_on_a_plain_table(self):
+        self.migrate(UnlessPartitioned([self.operation]))
+
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, GroupMessage._meta.db_table)
+        self.assertNotIn("chat_msg_group_seq_uniq", constraints)
@@ -0,0 +1,94 @@
+import time
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.template.loader import render_to_string
+
+from .debounce import RoomDebouncer
+from .redis_client import get_async_redis
+from .utility import room_group_name
+
+
+# Typing state lives only in Redis, never in the database:
+#   typing:{room}        ZSET  user_id -> expiry timestamp
+#   typing:{room}:last   the typers last broadcast, to skip no-op updates
+# Entries expire on their own, so a client that stops sending typing events
+# (or disappears) drops out after CHAT_TYPING_TTL seconds.
+
+
+def typing_key(chat_type, chat_name):
+    return f"typing:{{{chat_type}:{chat_name}}}"
+
+
+class AsyncTyping:
+
+    @staticmethod
+    async def start(chat_type, chat_name, user_id):
+        key = typing_key(chat_type, chat_name)
+        now = time.time()
+
+        async with get_async_redis().pipeline(transaction=False) as pipe:
+            pipe.zadd(key, {user_id: now + settings.CHAT_TYPING_TTL})
+            pipe.expire(key, settings.CHAT_TYPING_TTL * 2)
+            await pipe.execute()
+
+    @staticmethod
+    async def stop(chat_type, chat_name, user_id):
+        await get_async_redis().zrem(typing_key(chat_type, chat_name), user_id)
+
+    @staticmethod
+    async def typers(chat_type, chat_name):
+        key = typing_key(chat_type, chat_name)
+
+        async with get_async_redis().pipeline(transaction=False) as pipe:
+            pipe.zremrangebyscore(key, "-inf", time.time())
+            pipe.zrange(key, 0, -1)
+            _, members = await pipe.execute()
+
+        return sorted(int(member) for member in members)
+
+
+typing_debouncer = RoomDebouncer("typing", settings.CHAT_TYPING_BROADCAST_INTERVAL)
+
+
+def render_typing(count):
+    return render_to_string("chats/partials/typing.html", {"count": count})
+
+
+async def broadcast_typing(chat_type, chat_name):
+    """
+    Send the room who is typing, at most once per broadcast interval and
+    only when it changed. While anyone is still typing a follow-up check is
+    scheduled, so expired typers are cleared without a stop event.
+    """
+    user_ids = await AsyncTyping.typers(chat_type, chat_name)
+
+    last = ",".join(map(str, user_ids))
+    previous = await get_async_redis().set(
+        f"{typing_key(chat_type, chat_name)}:last", last, ex=settings.CHAT_TYPING_TTL * 2, get=True
+    )
+
+    if (previous or b"").decode() != last:
+        count = len(user_ids)
+
+        # Typers see everyone but themselves, so both variants are rendered
+        # once here rather than per connection.
+        await get_channel_layer().group_send(
+            room_group_name(chat_type, chat_name),
+            {
+                "type": "typing_handler",
+                "user_ids": user_ids,
+                "html": render_typing(count),
+                "typer_html": render_typing(max(count - 1, 0)),
+            }
+        )
+
+    if user_ids:
+        await schedule_typing(chat_type, chat_name)
+
+
+async def schedule_typing(chat_type, chat_name):
+    await typing_debouncer.schedule(
+        room_group_name(chat_type, chat_name),
+        lambda: broadcast_typing(chat_type, chat_name),
+    )
@@ -1,3 +1,31 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.utils import timezone
+
+
 def private_room_name(user1, user2):
     usernames = sorted([user1.username, user2.username])
     return f"{usernames[0]}-{usernames[1]}"
+
+def room_group_name(chat_type, chat_name):
+    return f"{chat_type}-{chat_name}"
+
+def encode_cursor(message):
+    raw = f"{message.created_at.isoformat()}|{message.id}"
+    return urlsafe_b64encode(raw.encode()).decode()
+
+def history_window(chat, until=None):
+    """
+    Oldest created_at a history query ending at ``until`` (by default the
+    chat's last message) looks at before it falls back to older rows.
+    """
+    until = until or chat.last_message_at or timezone.now()
+    return until - timedelta(days=settings.CHAT_HISTORY_WINDOW_DAYS)
+
+def decode_cursor(cursor):
+    try:
+        created_at, message_id = urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), int(message_id)
+    except ValueError:
+        return None
@@ -1,18 +1,19 @@
-from django.http import JsonResponse, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden
+from django.http import JsonResponse, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, StreamingHttpResponse
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.http import require_POST
 from django.core.exceptions import PermissionDenied
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
 from django.contrib import messages
 import json
 
+from Pinggo.db_router import use_replica
 from .models import ChatGroup
-from .utility import private_room_name
+from .utility import private_room_name, decode_cursor
 from .forms import ChatMessageCreateForm
 from .service.chat_service import ChatService
 from .service.message_service import MessageService
+from .service.search_service import SearchService
+from .service.export_service import ExportService
 from users.services.user_service import UserService
 
 
@@ -30,13 +31,14 @@ def chat_base_view(request):
 
 
 @login_required(login_url="account_login")
+@use_replica
 def chat_view(request, chat_type=None, chat_name=None):
     chat_types = ["global", "group", "private"]
 
     groups = None
     private_chats = None
     chat_group = None
-    chat_messages = None
+    history = None
     active_group = None
     other_user = None
     members = []
@@ -64,7 +66,8 @@ def chat_view(request, chat_type=None, chat_name=None):
             ChatService.get_members_username(chat_group)
         )
 
-        chat_messages = ChatService.get_chat_messages(chat_group)
+        history = ChatService.get_chat_messages(chat_group)
+        ChatService.mark_read(chat_group, request.user.id)
 
         if chat_group.chat_type == "private":
             other_user = ChatService.get_other_member(request.user.id, chat_group)
@@ -83,7 +86,7 @@ def chat_view(request, chat_type=None, chat_name=None):
             "private_chats": private_chats,
 
             "chat_group": chat_group,
-            "chat_messages": chat_messages,
+            "history": history,
             "members": members,
 
             "active_group": active_group,
@@ -95,6 +98,119 @@ def chat_view(request, chat_type=None, chat_name=None):
     )
 
 
+@login_required(login_url="account_login")
+@use_replica
+def chat_history(request, chat_type=None, chat_name=None):
+    if not request.htmx:
+        return HttpResponseBadRequest("Invalid request")
+
+    chat_group = ChatService.get_chat(chat_type, chat_name)
+
+    if not chat_group:
+        return HttpResponseBadRequest("Invalid request")
+
+    if not chat_group.can_view(request.user):
+        raise PermissionDenied("Invalid access")
+
+    before = request.GET.get("before")
+    after = request.GET.get("after")
+
+    if before:
+        before = decode_cursor(before)
+        if not before:
+            return HttpResponseBadRequest("Invalid cursor")
+
+    if after:
+        after = decode_cursor(after)
+        if not after:
+            return HttpResponseBadRequest("Invalid cursor")
+
+    history = ChatService.get_chat_messages(chat_group, before=before, after=after)
+
+    return render(
+        request,
+        "chats/partials/chat_history.html",
+        {
+            "active_type": chat_type,
+            "chat_group": chat_group,
+            "history": history,
+        }
+    )
+
+
+@login_required(login_url="account_login")
+@use_replica
+def search_messages(request):
+    if not request.htmx:
+        return HttpResponseBadRequest("Invalid request")
+
+    text = request.GET.get("q", "").strip()
+    chat_type = request.GET.get("chat_type")
+    chat_name = request.GET.get("chat_name")
+    chat = None
+
+    if chat_type and chat_name:
+        chat = ChatService.get_chat(chat_type, chat_name)
+
+        if not chat:
+            return HttpResponseBadRequest("Invalid request")
+
+        if not chat.can_view(request.user):
+            raise PermissionDenied("Invalid access")
+
+    before = request.GET.get("before")
+
+    if before:
+        before = decode_cursor(before)
+        if not before:
+            return HttpResponseBadRequest("Invalid cursor")
+
+    results = None
+    if text:
+        results = SearchService.search_messages(request.user, text, chat=chat, before=before)
+
+    return render(
+        request,
+        "chats/partials/search_results.html",
+        {
+            "q": text,
+            "results": results,
+            "chat_type": chat_type or "",
+            "chat_name": chat_name or "",
+        }
+    )
+
+
+EXPORT_CONTENT_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+@login_required(login_url="account_login")
+def export_chat(request, chat_type=None, chat_name=None):
+    chat = ChatService.get_chat(chat_type, chat_name)
+
+    if not chat:
+        return HttpResponseBadRequest("Invalid request")
+
+    if not chat.can_view(request.user):
+        raise PermissionDenied("Invalid access")
+
+    fmt = request.GET.get("format", "ndjson")
+    if fmt not in EXPORT_CONTENT_TYPES:
+        return HttpResponseBadRequest("Invalid format")
+
+    compress = request.GET.get("gzip") == "1"
+
+    response = StreamingHttpResponse(
+        ExportService.aexport(chat, fmt, compress),
+        content_type="application/gzip" if compress else EXPORT_CONTENT_TYPES[fmt],
+    )
+    response["Content-Disposition"] = f'attachment; filename="{ExportService.filename(chat, fmt, compress)}"'
+    return response
+
+
 @login_required(login_url="account_login")
 def create_group(request):
     if request.method != "POST":
@@ -202,14 +318,7 @@ def upload_file(request, chat_type=None, chat_name=None):
         file_name=file_name,
     )
 
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
-        f"{chat_type}-{chat_name}",
-        {
-            "type": "message_handler",
-            "message_id": message.id,
-        }
-    )
+    MessageService.publish_sync(message, chat_type, chat_name)
 
     return HttpResponse(status=204)
 
@@ -229,7 +338,7 @@ def leave_group(request, chat_type=None, chat_name=None):
         messages.warning(request, "Unauthorized access")
         return redirect("chat_type", chat_type=chat_type)
 
-    chat.members.remove(request.user)
+    ChatService.leave_group(chat, request.user)
 
     messages.success(request, "You have left the chat")
     return redirect("chat_type", chat_type=chat_type)
@@ -1,64 +1,194 @@
-from django.core.files import File
-from django.core.management.base import BaseCommand
+from concurrent.futures import ThreadPoolExecutor
+from django.apps import apps
 from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import storages
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
 from pathlib import Path
-import mimetypes
+from urllib.parse import unquote, urlsplit
+import json
+import os
+import time
 
-class Command(BaseCommand):
-    help = "Migrate local media files to Cloudinary"
 
-    def handle(self, *args, **kwargs):
-        self.stdout.write("Starting media migration...")
+# (checkpoint key, model, URL field, upload folder)
+TARGETS = [
+    ("profiles", "users.Profile", "image_url", "avatar"),
+    ("groups", "chats.ChatGroup", "image_url", "chat/images"),
+    ("messages", "chats.GroupMessage", "file_url", "chat/files"),
+]
 
-        from users.models import Profile
-        from chats.models import ChatGroup, GroupMessage
 
-        for profile in Profile.objects.exclude(image=""):
-            self.migrate(profile, "image", "avatar")
+class Command(BaseCommand):
+    help = "Migrate local media files to Cloudinary (or any configured storage)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--storage",
+            default="default",
+            help="STORAGES alias to upload to (default: %(default)s)",
+        )
+        parser.add_argument(
+            "--media-root",
+            default=settings.MEDIA_ROOT or settings.BASE_DIR / "media",
+            help="Directory the local media URLs resolve against",
+        )
+        parser.add_argument("--workers", type=int, default=8, help="Concurrent uploads")
+        parser.add_argument("--batch-size", type=int, default=200, help="Rows per bulk_update")
+        parser.add_argument(
+            "--checkpoint",
+            default="media_migration.checkpoint.json",
+            help="File recording the last migrated id per table, for resuming",
+        )
+        parser.add_argument("--restart", action="store_true", help="Ignore an existing checkpoint")
+
+    def handle(self, *args, **options):
+        if options["workers"] < 1 or options["batch_size"] < 1:
+            raise CommandError("--workers and --batch-size must be positive.")
+
+        try:
+            self.storage = storages[options["storage"]]
+        except Exception as e:
+            raise CommandError(f"Unknown storage '{options['storage']}': {e}")
 
-        for group in ChatGroup.objects.exclude(image=""):
-            self.migrate(group, "image", "chat/images")
+        self.media_root = Path(options["media_root"])
+        self.checkpoint_path = Path(options["checkpoint"])
+        self.checkpoint = {} if options["restart"] else self.load_checkpoint()
+        self.uploaded = self.failed = self.missing = self.bytes = 0
+        self.started = time.monotonic()
 
-        for msg in GroupMessage.objects.exclude(file=""):
-            self.migrate(msg, "file", "chat/files")
+        self.stdout.write("Starting media migration...")
 
-        self.stdout.write(self.style.SUCCESS("Finished media migration 🎉"))
+        with ThreadPoolExecutor(max_workers=options["workers"]) as pool:
+            for key, label, field, folder in TARGETS:
+                self.migrate_table(pool, key, apps.get_model(label), field, folder, options["batch_size"])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Finished media migration: {self.uploaded} uploaded, {self.missing} missing, "
+            f"{self.failed} failed ({self.throughput()})"
+        ))
+
+        if self.failed:
+            self.stdout.write(self.style.WARNING(
+                "Failed rows keep their local URL; rerun with --restart to retry them."
+            ))
+
+    def load_checkpoint(self):
+        if not self.checkpoint_path.exists():
+            return {}
+
+        checkpoint = json.loads(self.checkpoint_path.read_text())
+        self.stdout.write(f"Resuming from {self.checkpoint_path}: {checkpoint}")
+        return checkpoint
+
+    def save_checkpoint(self):
+        # Write-then-rename, so an interrupted run never leaves a torn file.
+        tmp = self.checkpoint_path.with_name(self.checkpoint_path.name + ".tmp")
+        tmp.write_text(json.dumps(self.checkpoint))
+        os.replace(tmp, self.checkpoint_path)
+
+    def local_name(self, url):
+        """
+        Path of a local media URL relative to the media root.
+        """
+        path = urlsplit(url).path
+
+        if path.startswith(settings.MEDIA_URL):
+            path = path[len(settings.MEDIA_URL):]
+
+        return unquote(path.lstrip("/"))
+
+    def pending(self, model, field):
+        """
+        Rows whose URL is still a local media path; absolute URLs are
+        already hosted somewhere and are left alone.
+        """
+        return (
+            model.objects.exclude(**{f"{field}__isnull": True})
+            .exclude(**{field: ""})
+            .exclude(Q(**{f"{field}__startswith": "http://"}) | Q(**{f"{field}__startswith": "https://"}))
+            .order_by("pk")
+        )
+
+    def migrate_table(self, pool, key, model, field, folder, batch_size):
+        last_pk = self.checkpoint.get(key, 0)
+        rows = self.pending(model, field)
+        total = rows.filter(pk__gt=last_pk).count()
+        done = 0
+
+        self.stdout.write(f"{key}: {total} file(s) to migrate")
+
+        while True:
+            batch = list(rows.filter(pk__gt=last_pk).only("pk", field)[:batch_size])
+
+            if not batch:
+                break
+
+            updated = []
+            for instance, (status, url, size) in zip(
+                batch, pool.map(lambda obj: self.upload(getattr(obj, field), folder), batch)
+            ):
+                if status == "uploaded":
+                    setattr(instance, field, url)
+                    updated.append(instance)
+                    self.uploaded += 1
+                    self.bytes += size
+                elif status == "missing":
+                    self.missing += 1
+                else:
+                    self.failed += 1
 
-    def migrate(self, instance, field_name, _unused=None):
-        field = getattr(instance, field_name)
+            if updated:
+                model.objects.bulk_update(updated, [field])
+                self.invalidate(model, updated)
 
-        if not field or field.name.startswith(("http://", "https://")):
-            return
+            last_pk = batch[-1].pk
+            self.checkpoint[key] = last_pk
+            self.save_checkpoint()
 
-        local_path = Path(settings.MEDIA_ROOT) / field.name
+            done += len(batch)
+            self.stdout.write(f"{key}: {done}/{total} ({self.throughput()})")
 
-        if not local_path.exists():
-            self.stdout.write(
-                self.style.WARNING(f"Missing: {field.name}")
-            )
-            return
+    def upload(self, url, folder):
+        """
+        Upload one local file; returns (status, new URL, size). Runs on a
+        pool thread, so it leaves the counters to the caller.
+        """
+        name = self.local_name(url)
+        local_path = self.media_root / name
 
-        mime, _ = mimetypes.guess_type(str(local_path))
+        if not name or not local_path.is_file():
+            self.stdout.write(self.style.WARNING(f"Missing: {url}"))
+            return "missing", None, 0
 
         try:
             with local_path.open("rb") as f:
-                django_file = File(f)
-
-                if mime:
-                    if mime.startswith("image"):
-                        django_file.resource_type = "image"
-                    elif mime.startswith("video"):
-                        django_file.resource_type = "video"
-                    else:
-                        django_file.resource_type = "raw"
-                else:
-                    django_file.resource_type = "raw"
-
-                field.save(field.name, django_file, save=True)
-
-            self.stdout.write(self.style.SUCCESS(f"Uploaded → {field.name}"))
-
+                saved = self.storage.save(f"{folder}/{local_path.name}", File(f))
+            return "uploaded", self.storage.url(saved), local_path.stat().st_size
         except Exception as e:
-            self.stdout.write(
-                self.style.ERROR(f"Failed {field.name}: {e}")
-            )
+            self.stdout.write(self.style.ERROR(f"Failed {name}: {e}"))
+            return "failed", None, 0
+
+    def invalidate(self, model, instances):
+        # bulk_update skips the post_save receivers that keep the read
+        # caches fresh.
+        from chats.models import ChatGroup
+        from chats.service.chat_service import chat_cache, chat_cache_key
+        from users.models import Profile
+        from users.services.user_service import profile_cache
+
+        if model is Profile:
+            profile_cache.invalidate(*(
+                user_id for user_id in
+                Profile.objects.filter(pk__in=[p.pk for p in instances]).values_list("user_id", flat=True)
+            ))
+        elif model is ChatGroup:
+            chat_cache.invalidate(*(
+                chat_cache_key(chat_type, name) for chat_type, name in
+                ChatGroup.objects.filter(pk__in=[g.pk for g in instances]).values_list("chat_type", "group_name")
+            ))
+
+    def throughput(self):
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        return f"{self.uploaded / elapsed:.1f} files/s, {self.bytes / elapsed / 1024 / 1024:.2f} MB/s"
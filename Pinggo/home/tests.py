@@ -1,3 +1,162 @@
-from django.test import TestCase
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.storage import FileSystemStorage
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from io import StringIO
+from pathlib import Path
+import json
+import shutil
+import tempfile
 
-# Create your tests here.
+from Pinggo import db_router
+from chats.models import ChatGroup, GroupMessage
+
+
+class FlakyStorage(FileSystemStorage):
+    """
+    Local stand-in for Cloudinary that refuses any file named "broken*".
+    """
+
+    def _save(self, name, content):
+        if Path(name).name.startswith("broken"):
+            raise OSError("upload refused")
+        return super()._save(name, content)
+
+
+class MigrateMediaTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("uploader")
+        cls.chat = ChatGroup.objects.create(group_name="media-room", chat_type="group", creator=cls.user)
+
+    def setUp(self):
+        self.tmp = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+        self.media_root = self.tmp / "media"
+        self.cloud_root = self.tmp / "cloud"
+        self.checkpoint = self.tmp / "checkpoint.json"
+
+        self.enterContext(self.settings(STORAGES={
+            "default": {"BACKEND": "django.core.files.storage.InMemoryStorage"},
+            "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+            "cloud": {
+                "BACKEND": "home.tests.FlakyStorage",
+                "OPTIONS": {"location": self.cloud_root, "base_url": "https://cdn.example.com/"},
+            },
+        }))
+
+    def add_files(self, *names, on_disk=True):
+        """
+        One message per file, pointing at its local media URL.
+        """
+        folder = self.media_root / "chat" / "files"
+        folder.mkdir(parents=True, exist_ok=True)
+
+        for name in names:
+            if on_disk:
+                (folder / name).write_text(f"contents of {name}")
+
+        # bulk_create: save() would validate the relative URL away.
+        return GroupMessage.objects.bulk_create(
+            GroupMessage(group=self.chat, author=self.user, file_url=f"/media/chat/files/{name}", file_name=name)
+            for name in names
+        )
+
+    def migrate(self, *args):
+        out = StringIO()
+        call_command(
+            "migrate_media_to_cloudinary",
+            "--storage=cloud",
+            f"--media-root={self.media_root}",
+            f"--checkpoint={self.checkpoint}",
+            *args,
+            stdout=out,
+        )
+        return out.getvalue()
+
+    @staticmethod
+    def urls(messages):
+        return [GroupMessage.objects.get(pk=message.pk).file_url for message in messages]
+
+    def test_files_are_uploaded_and_urls_rewritten_in_batches(self):
+        messages = self.add_files(*(f"file{i}.txt" for i in range(5)))
+
+        with CaptureQueriesContext(connection) as queries:
+            output = self.migrate("--batch-size=2")
+
+        self.assertIn("5 uploaded, 0 missing, 0 failed", output)
+        self.assertEqual(
+            self.urls(messages),
+            [f"https://cdn.example.com/chat/files/file{i}.txt" for i in range(5)],
+        )
+        self.assertEqual((self.cloud_root / "chat" / "files" / "file3.txt").read_text(), "contents of file3.txt")
+
+        # One bulk_update per batch of two, not one UPDATE per row.
+        updates = [q for q in queries if q["sql"].startswith('UPDATE "chats_groupmessage"')]
+        self.assertEqual(len(updates), 3)
+        self.assertEqual(json.loads(self.checkpoint.read_text())["messages"], messages[-1].pk)
+
+    def test_resumes_after_checkpoint(self):
+        messages = self.add_files(*(f"file{i}.txt" for i in range(4)))
+        self.checkpoint.write_text(json.dumps({"messages": messages[1].pk}))
+
+        output = self.migrate()
+
+        self.assertIn("Resuming from", output)
+        self.assertIn("messages: 2 file(s) to migrate", output)
+        self.assertIn("2 uploaded", output)
+        self.assertEqual(self.urls(messages)[:2], ["/media/chat/files/file0.txt", "/media/chat/files/file1.txt"])
+        self.assertTrue(all(url.startswith("https://") for url in self.urls(messages)[2:]))
+
+    def test_restart_ignores_checkpoint(self):
+        messages = self.add_files("file0.txt", "file1.txt")
+        self.checkpoint.write_text(json.dumps({"messages": messages[-1].pk}))
+
+        output = self.migrate("--restart")
+
+        self.assertIn("2 uploaded", output)
+
+    def test_failed_and_missing_files_keep_local_url(self):
+        uploaded, broken = self.add_files("file0.txt", "broken.txt")
+        (missing,) = self.add_files("gone.txt", on_disk=False)
+
+        output = self.migrate("--batch-size=2")
+
+        self.assertIn("1 uploaded, 1 missing, 1 failed", output)
+        self.assertIn("Failed chat/files/broken.txt: upload refused", output)
+        self.assertIn("rerun with --restart", output)
+        self.assertEqual(
+            self.urls([uploaded, broken, missing]),
+            [
+                "https://cdn.example.com/chat/files/file0.txt",
+                "/media/chat/files/broken.txt",
+                "/media/chat/files/gone.txt",
+            ],
+        )
+
+        # The run got past them; a retry is an explicit --restart.
+        self.assertEqual(json.loads(self.checkpoint.read_text())["messages"], missing.pk)
+
+
+@override_settings(REPLICA_STICKY_SECONDS=10)
+class ReplicaStickinessTests(SimpleTestCase):
+
+    user_id = -1
+
+    def setUp(self):
+        db_router._marked.pop(self.user_id, None)
+        cache.delete(db_router.sticky_key(self.user_id))
+        self.addCleanup(cache.delete, db_router.sticky_key(self.user_id))
+
+    def test_every_write_gets_the_full_window(self):
+        db_router.mark_sticky(self.user_id)
+
+        # Writes in the next 5s don't refresh the marker, so it has to last
+        # until 10s after the latest of them.
+        self.assertFalse(db_router.claim_mark(self.user_id))
+        self.assertGreaterEqual(cache.ttl(db_router.sticky_key(self.user_id)), 10 + 5 - 1)
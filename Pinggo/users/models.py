@@ -1,4 +1,6 @@
+from django.contrib.postgres.indexes import GinIndex, OpClass
 from django.db import models
+from django.db.models.functions import Lower
 from django.contrib.auth.models import User
 from django.templatetags.static import static
 
@@ -24,4 +26,13 @@ class Profile(models.Model):
     def avatar(self):
         if self.image_url:
             return self.image_url
-        return static('images/avatar.svg')
\ No newline at end of file
+        return static('images/avatar.svg')
+
+    class Meta:
+        indexes = [
+            # Prefix (LIKE 'q%') and fuzzy (%) lookups for user search. The
+            # matching indexes on auth_user.username are created in
+            # users.signals, since that table isn't ours.
+            models.Index(OpClass(Lower("displayname"), name="text_pattern_ops"), name="profile_displayname_like_idx"),
+            GinIndex(OpClass(Lower("displayname"), name="gin_trgm_ops"), name="profile_displayname_trgm_idx"),
+        ]
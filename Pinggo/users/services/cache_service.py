@@ -0,0 +1,154 @@
+from collections import Counter, OrderedDict
+import pickle
+import threading
+import time
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from Pinggo.metrics import metrics
+
+
+# Stands in for "looked up, doesn't exist" so misses are cached too.
+MISSING = "__missing__"
+
+
+class ReadThroughCache:
+    """
+    Two-tier read-through cache for hot lookups: a small in-process LRU in
+    front of the shared django_redis cache, then the loader.
+
+    Keys carry the namespace ``version``; bump it when the cached shape
+    changes so old entries are never read back. The local tier holds
+    pickled values, so every caller gets its own copy, and only keeps them
+    for READ_CACHE_LOCAL_TTL seconds: that is how stale another process'
+    copy can be after an invalidation.
+
+    Hits and misses are counted per process in ``stats`` and across
+    processes in the ``cache.<namespace>.*`` metrics.
+    """
+
+    registry = {}
+
+    def __init__(self, namespace, version=1, timeout=None):
+        self.namespace = namespace
+        self.version = version
+        self.timeout = timeout or settings.READ_CACHE_TIMEOUT
+        self.local = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = Counter()
+        ReadThroughCache.registry[namespace] = self
+
+    def key(self, ident):
+        return f"rt:{self.namespace}:v{self.version}:{ident}"
+
+    def get_local(self, key):
+        with self.lock:
+            entry = self.local.get(key)
+
+            if entry is None:
+                return None
+
+            expires, value = entry
+            if expires < time.monotonic():
+                del self.local[key]
+                return None
+
+            self.local.move_to_end(key)
+            return value
+
+    def set_local(self, key, value):
+        with self.lock:
+            self.local[key] = (time.monotonic() + settings.READ_CACHE_LOCAL_TTL, value)
+            self.local.move_to_end(key)
+
+            while len(self.local) > settings.READ_CACHE_LOCAL_SIZE:
+                self.local.popitem(last=False)
+
+    def count(self, outcome):
+        self.stats[outcome] += 1
+        metrics.incr(f"cache.{self.namespace}.{outcome}")
+
+    def hit(self, tier, value):
+        self.count(tier)
+        value = pickle.loads(value)
+        return None if value == MISSING else value
+
+    def get(self, ident, loader):
+        key = self.key(ident)
+
+        value = self.get_local(key)
+        if value is not None:
+            return self.hit("local_hits", value)
+
+        value = cache.get(key)
+        if value is not None:
+            self.set_local(key, value)
+            return self.hit("hits", value)
+
+        self.count("misses")
+        result = loader()
+
+        value = pickle.dumps(MISSING if result is None else result)
+        cache.set(key, value, self.timeout)
+        self.set_local(key, value)
+        return result
+
+    async def aget(self, ident, loader):
+        key = self.key(ident)
+
+        value = self.get_local(key)
+        if value is not None:
+            return self.hit("local_hits", value)
+
+        value = await cache.aget(key)
+        if value is not None:
+            self.set_local(key, value)
+            return self.hit("hits", value)
+
+        self.count("misses")
+        result = await database_sync_to_async(loader)()
+
+        value = pickle.dumps(MISSING if result is None else result)
+        await cache.aset(key, value, self.timeout)
+        self.set_local(key, value)
+        return result
+
+    def delete(self, *idents):
+        keys = [self.key(ident) for ident in idents]
+
+        with self.lock:
+            for key in keys:
+                self.local.pop(key, None)
+
+        cache.delete_many(keys)
+
+    def invalidate(self, *idents):
+        """
+        Drop entries now and again once the transaction commits, so a reader
+        racing the write can't re-cache the old row for the full timeout.
+        """
+        self.delete(*idents)
+        transaction.on_commit(lambda: self.delete(*idents))
+
+    def report(self):
+        looked_up = sum(self.stats.values())
+        hits = self.stats["local_hits"] + self.stats["hits"]
+        return {
+            "local_hits": self.stats["local_hits"],
+            "hits": self.stats["hits"],
+            "misses": self.stats["misses"],
+            "hit_rate": round(hits / looked_up, 3) if looked_up else None,
+            "local_size": len(self.local),
+        }
+
+    @staticmethod
+    def report_all():
+        return {namespace: entry.report() for namespace, entry in ReadThroughCache.registry.items()}
+
+
+@metrics.reporter("cache")
+def report_caches():
+    return ReadThroughCache.report_all()
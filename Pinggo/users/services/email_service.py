@@ -1,8 +1,12 @@
 from allauth.account.models import EmailAddress
+from channels.db import database_sync_to_async
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.db import transaction
 
 
+EMAIL_VERIFIED_CACHE_TIMEOUT = 60 * 60 * 24
+
 
 class EmailService:
     def __init__(self):
@@ -45,9 +49,46 @@ class EmailService:
         user.email = new_email
         user.save(update_fields=["email"])
 
+        transaction.on_commit(lambda: EmailService.invalidate_email_verified(user.id))
+
         return True
 
 
+    @staticmethod
+    def email_verified_cache_key(user_id) -> str:
+        return f"email_verified:{user_id}"
+
+
+    @staticmethod
+    def is_email_verified(user) -> bool:
+        key = EmailService.email_verified_cache_key(user.id)
+        is_verified = cache.get(key)
+
+        if is_verified is None:
+            is_verified = EmailAddress.objects.filter(
+                user=user,
+                verified=True,
+            ).exists()
+            cache.set(key, is_verified, EMAIL_VERIFIED_CACHE_TIMEOUT)
+
+        return is_verified
+
+
+    @staticmethod
+    async def async_is_email_verified(user) -> bool:
+        is_verified = await cache.aget(EmailService.email_verified_cache_key(user.id))
+
+        if is_verified is None:
+            is_verified = await database_sync_to_async(EmailService.is_email_verified)(user)
+
+        return is_verified
+
+
+    @staticmethod
+    def invalidate_email_verified(user_id):
+        cache.delete(EmailService.email_verified_cache_key(user_id))
+
+
     def is_email_unverified(self, user) -> bool:
         self.email_address = EmailAddress.objects.filter(
             user=user,
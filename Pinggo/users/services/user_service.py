@@ -1,9 +1,23 @@
+from django.contrib.postgres.search import TrigramSimilarity
+from django.core.cache import cache
 from django.shortcuts import get_object_or_404
 from django.contrib.auth.models import User
 from django.contrib.auth import logout
+from django.db.models.functions import Lower
 
 from ..models import Profile
 from ..exception import ProfileDoesNotExist
+from .cache_service import ReadThroughCache
+
+
+USER_SEARCH_LIMIT = 8
+USER_SEARCH_MAX_LENGTH = 30
+USER_SEARCH_FUZZY_MIN_LENGTH = 3
+USER_SEARCH_CACHE_TIMEOUT = 60
+
+# User with its profile, by user id. Invalidated in users.signals.
+# v2: cached users no longer carry the password hash.
+profile_cache = ReadThroughCache("user-profile", version=2)
 
 
 class UserService:
@@ -20,6 +34,65 @@ class UserService:
     def get_users_object(usernames):
         return User.objects.filter(username__in=usernames)
 
+    @staticmethod
+    def search_users(query, exclude_user_id=None, limit=USER_SEARCH_LIMIT) -> list:
+        """
+        Autocomplete over username and display name: prefix matches first,
+        then (for 3+ characters) trigram matches by similarity. Results are
+        small dicts, cached per query so hot prefixes skip the database.
+        """
+        query = query.strip().lower()[:USER_SEARCH_MAX_LENGTH]
+
+        if not query:
+            return []
+
+        key = f"user-search:{query}"
+        results = cache.get(key)
+
+        if results is None:
+            results = UserService.find_users(query, limit + 1)
+            cache.set(key, results, USER_SEARCH_CACHE_TIMEOUT)
+
+        return [user for user in results if user["id"] != exclude_user_id][:limit]
+
+    @staticmethod
+    def find_users(query, limit) -> list:
+        # Each lookup is its own query so every one can use its index
+        # (an OR across auth_user and profile can't).
+        profiles = Profile.objects.filter(user__is_active=True).select_related("user")
+        by_name = profiles.annotate(name_lower=Lower("displayname"))
+
+        found = {}
+
+        lookups = [
+            profiles.filter(user__username__startswith=query).order_by("user__username"),
+            by_name.filter(name_lower__startswith=query).order_by("name_lower"),
+        ]
+
+        if len(query) >= USER_SEARCH_FUZZY_MIN_LENGTH:
+            lookups += [
+                profiles.filter(user__username__trigram_similar=query)
+                .annotate(similarity=TrigramSimilarity("user__username", query))
+                .order_by("-similarity"),
+                by_name.filter(name_lower__trigram_similar=query)
+                .annotate(similarity=TrigramSimilarity("name_lower", query))
+                .order_by("-similarity"),
+            ]
+
+        for lookup in lookups:
+            if len(found) >= limit:
+                break
+
+            for profile in lookup[:limit]:
+                found.setdefault(profile.user_id, {
+                    "id": profile.user_id,
+                    "username": profile.user.username,
+                    "name": profile.name,
+                    "avatar": profile.avatar,
+                })
+
+        return list(found.values())[:limit]
+
     @staticmethod
     def get_user_details_by_username(username) -> Profile:
         return get_object_or_404(User, username=username).profile
@@ -32,10 +105,31 @@ class UserService:
     def does_user_already_exist_by_username(user_id, username) -> bool:
         return User.objects.filter(username=username).exclude(pk=user_id).exists()
 
+    @staticmethod
+    def load_user_with_profile(user_id) -> User:
+        # Cached in Redis, so leave the password hash behind.
+        return User.objects.select_related("profile").defer("password").filter(id=user_id).first()
+
+    @staticmethod
+    def get_user_with_profile(user_id) -> User:
+        return profile_cache.get(
+            user_id,
+            lambda: UserService.load_user_with_profile(user_id),
+        )
+
+    @staticmethod
+    async def async_get_user_with_profile(user_id) -> User:
+        return await profile_cache.aget(
+            user_id,
+            lambda: UserService.load_user_with_profile(user_id),
+        )
+
     @staticmethod
     def get_user_details(user):
         try:
-            user = User.objects.select_related("profile").get(id=user.id)
+            user = UserService.get_user_with_profile(user.id)
+            if user is None:
+                raise Profile.DoesNotExist
             info = user.profile
             return info
         except Profile.DoesNotExist:
@@ -1,8 +1,12 @@
+from allauth.account.signals import email_confirmed
 from django.dispatch import receiver
-from django.db.models.signals import post_save, pre_save
+from django.db import connections
+from django.db.models.signals import post_delete, post_migrate, post_save, pre_migrate, pre_save
 from django.contrib.auth.models import User
 
 from .models import Profile
+from .services.email_service import EmailService
+from .services.user_service import profile_cache
 
 
 @receiver(post_save, sender=User)
@@ -12,8 +16,51 @@ def user_post_save(sender, instance, created, **kwargs):
     if created:
         Profile.objects.create(user=user)
 
+    profile_cache.invalidate(user.id)
+
+
+@receiver(post_delete, sender=User)
+def user_post_delete(sender, instance, **kwargs):
+    profile_cache.invalidate(instance.id)
+
+
+@receiver(post_save, sender=Profile)
+@receiver(post_delete, sender=Profile)
+def profile_changed(sender, instance, **kwargs):
+    profile_cache.invalidate(instance.user_id)
+
 
 @receiver(pre_save, sender=User)
 def user_pre_save(sender, instance, **kwargs):
     if instance.username:
         instance.username = instance.username.lower()
+
+
+@receiver(email_confirmed)
+def user_email_confirmed(sender, request, email_address, **kwargs):
+    EmailService.invalidate_email_verified(email_address.user_id)
+
+
+@receiver(pre_migrate)
+def users_pre_migrate(sender, app_config=None, using="default", **kwargs):
+    # The trigram indexes need pg_trgm; the app's migrations aren't checked in.
+    if app_config is None or app_config.name != "users" or connections[using].vendor != "postgresql":
+        return
+
+    with connections[using].cursor() as cursor:
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+
+
+@receiver(post_migrate)
+def users_post_migrate(sender, app_config=None, using="default", **kwargs):
+    # Usernames are stored lowercase (see user_pre_save), so the trigram
+    # index can be on the bare column. Prefix lookups already use the
+    # varchar_pattern_ops index Django creates for the unique username.
+    if app_config is None or app_config.name != "users" or connections[using].vendor != "postgresql":
+        return
+
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            f"CREATE INDEX IF NOT EXISTS auth_user_username_trgm_idx "
+            f"ON {User._meta.db_table} USING gin (username gin_trgm_ops)"
+        )
@@ -0,0 +1,92 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.db.models.functions import Lower
+from django.test import TestCase, override_settings
+from unittest import skipUnless
+
+from users.models import Profile
+from users.services.user_service import UserService
+
+
+# Local storages: no Cloudinary account and no collectstatic manifest.
+TEST_STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.InMemoryStorage"},
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+}
+
+
+def has_trigram():
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        return cursor.fetchone() is not None
+
+
+@override_settings(STORAGES=TEST_STORAGES)
+class UserSearchTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.anna = cls.create_user("anna", "Zed")
+        cls.annabel = cls.create_user("annabel")
+        cls.bob = cls.create_user("bob", "Annie")
+        cls.joanna = cls.create_user("joanna")
+        cls.create_user("annex", is_active=False)
+
+    @staticmethod
+    def create_user(username, displayname=None, is_active=True):
+        user = User.objects.create_user(username, is_active=is_active)
+        Profile.objects.filter(user=user).update(displayname=displayname)
+        return user
+
+    def setUp(self):
+        # Results are cached per query; start every test cold.
+        cache.delete_many([f"user-search:{query}" for query in ("an", "ann", "joana")])
+
+    @staticmethod
+    def usernames(results):
+        return [user["username"] for user in results]
+
+    def test_username_prefix_ranks_before_display_name_prefix(self):
+        self.assertEqual(self.usernames(UserService.search_users("An")), ["anna", "annabel", "bob"])
+
+    def test_inactive_users_are_not_found(self):
+        self.assertNotIn("annex", self.usernames(UserService.search_users("an")))
+
+    def test_current_user_is_excluded(self):
+        self.assertEqual(
+            self.usernames(UserService.search_users("an", exclude_user_id=self.anna.id)),
+            ["annabel", "bob"],
+        )
+        # The cached results are shared, the exclusion is not.
+        self.assertEqual(
+            self.usernames(UserService.search_users("an", exclude_user_id=self.bob.id)),
+            ["anna", "annabel"],
+        )
+
+    def test_exclusion_keeps_the_limit_filled(self):
+        results = UserService.search_users("an", exclude_user_id=self.anna.id, limit=2)
+        self.assertEqual(self.usernames(results), ["annabel", "bob"])
+
+    @skipUnless(connection.vendor == "postgresql", "trigram search needs Postgres")
+    def test_fuzzy_matches_rank_after_prefix_matches(self):
+        if not has_trigram():
+            self.skipTest("pg_trgm is not installed")
+
+        self.assertEqual(self.usernames(UserService.search_users("ann"))[:3], ["anna", "annabel", "bob"])
+        self.assertIn("joanna", self.usernames(UserService.search_users("joana")))
+
+    @skipUnless(connection.vendor == "postgresql", "checks a Postgres index")
+    def test_display_name_prefix_uses_index(self):
+        query = (
+            Profile.objects.annotate(name_lower=Lower("displayname"))
+            .filter(name_lower__startswith="an")
+            .order_by("name_lower")[:9]
+        )
+
+        with connection.cursor() as cursor:
+            # The table is tiny; make the planner show whether the index
+            # can serve the lookup at all. Undone with the test transaction.
+            cursor.execute("SET LOCAL enable_seqscan = off")
+
+        self.assertIn("profile_displayname_like_idx", query.explain())
@@ -1,6 +1,6 @@
 from django.urls import path
 
-from .views import ProfileView, ProfileEditView, ProfileSettingsView, ProfileDeleteView, ProfileEmailChangeView, ProfileEmailVerifyView
+from .views import ProfileView, ProfileEditView, ProfileSettingsView, ProfileDeleteView, ProfileEmailChangeView, ProfileEmailVerifyView, UserSearchView
 
 urlpatterns = [
     path('', ProfileView.as_view(), name='profile'),
@@ -11,4 +11,5 @@ urlpatterns = [
     path('emailchange/', ProfileEmailChangeView.as_view(), name='profile_email_change'),
     path('verify/', ProfileEmailVerifyView.as_view(), name='profile_verify'),
     path('delete/', ProfileDeleteView.as_view(), name='profile_delete'),
+    path('search/', UserSearchView.as_view(), name='user_search'),
 ]
\ No newline at end of file
@@ -1,9 +1,13 @@
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.views import View
 from django.views.generic import TemplateView, FormView, DeleteView
+from django.http import JsonResponse
 from django.shortcuts import render, redirect
 from django.contrib import messages
 from django.urls import reverse_lazy
+from django.utils.decorators import method_decorator
+
+from Pinggo.db_router import use_replica
 
 from .exception import ProfileDoesNotExist
 from .forms import ProfileForm, EmailForm
@@ -12,6 +16,7 @@ from .services.email_service import EmailService
 
 
 
+@method_decorator(use_replica, name='dispatch')
 class ProfileView(TemplateView):
     template_name = "users/profile.html"
 
@@ -118,3 +123,11 @@ class ProfileDeleteView(LoginRequiredMixin, View):
         messages.success(request, 'Account deleted.')
         return redirect('home')
 
+
+@method_decorator(use_replica, name='dispatch')
+class UserSearchView(LoginRequiredMixin, View):
+    login_url = 'account_login'
+
+    def get(self, request, *args, **kwargs):
+        users = UserService.search_users(request.GET.get('q', ''), exclude_user_id=request.user.id)
+        return JsonResponse({'users': users})